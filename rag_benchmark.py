@@ -0,0 +1,210 @@
+import argparse
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import rag_main
+from rag_generator import DEFAULT_STOP_STRINGS, Generator
+from rag_retriever import Retriever
+from rag_setup import VectorDB
+
+# Настройка логирования для бенчмарков
+logging.basicConfig(
+    filename = 'rag_benchmark.log',
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s',
+    encoding = 'utf-8'
+)
+
+# Вопросы по умолчанию: короткие, обычные и требующие объяснения
+DEFAULT_QUESTIONS = [
+    'Что такое кортеж в Python?',
+    'Какие есть типы данных в Python?',
+    'Как работает оператор with?',
+    'Почему в Python числа с плавающей точкой неточны?',
+    'Расскажи про виртуальные окружения',
+]
+
+# Режимы декодирования: (название, стоп-строки, максимум предложений, адаптивный лимит, assisted)
+DECODING_MODES = [
+    ('baseline', (), None, False, False),
+    ('stop_strings', DEFAULT_STOP_STRINGS, None, False, False),
+    ('stop_sentences', DEFAULT_STOP_STRINGS, 3, False, False),
+    ('adaptive', DEFAULT_STOP_STRINGS, 3, True, False),
+    ('assisted', DEFAULT_STOP_STRINGS, 3, True, True),
+]
+
+# Уровни параллельности для бенчмарка распределения ресурсов
+DEFAULT_CONCURRENCY_LEVELS = (1, 4, 16)
+
+def retrieve_contexts(questions, n_results = 3):
+    '''
+    Находит контекст для каждого вопроса один раз, чтобы замерять только генерацию.
+
+    Args:
+        questions (list): Список вопросов.
+        n_results (int): Количество чанков на вопрос.
+
+    Returns:
+        list: Списки релевантных чанков в том же порядке, что и вопросы.
+    '''
+    vector_db = VectorDB()
+    vector_db.initialize_client()
+
+    retriever = Retriever(vector_db)
+    retriever.initialize_retriever()
+
+    return [retriever.search_relevant_chunks(question, n_results) for question in questions]
+
+def run_decoding_benchmark(generator, questions, contexts, repeats = 1):
+    '''
+    Замеряет скорость генерации (токены/с) и задержку для каждого режима декодирования.
+
+    Args:
+        generator (Generator): Инициализированный генератор.
+        questions (list): Список вопросов.
+        contexts (list): Контекст для каждого вопроса.
+        repeats (int): Сколько раз повторять каждый вопрос.
+
+    Returns:
+        list: Словари с результатами по каждому режиму.
+    '''
+    draft_model = generator.draft_model
+    results = []
+
+    for name, stop_strings, max_sentences, adaptive, assisted in DECODING_MODES:
+        if assisted and draft_model is None:
+            logging.info(f'Режим {name} пропущен: черновая модель не указана')
+            continue
+
+        # Переключаем параметры одного генератора, чтобы не загружать модель заново
+        generator.stop_strings = stop_strings
+        generator.max_sentences = max_sentences
+        generator.adaptive_max_tokens = adaptive
+        generator.draft_model = draft_model if assisted else None
+
+        latencies = []
+        tokens = []
+        speeds = []
+
+        for _ in range(repeats):
+            for question, chunks in zip(questions, contexts):
+                generator.generate_answer(question, chunks)
+                stats = generator.last_generation_stats
+                latencies.append(stats['latency'])
+                tokens.append(stats['generated_tokens'])
+                speeds.append(stats['tokens_per_second'])
+
+        results.append({
+            'mode': name,
+            'requests': len(latencies),
+            'mean_latency': statistics.mean(latencies),
+            'max_latency': max(latencies),
+            'mean_tokens': statistics.mean(tokens),
+            'tokens_per_second': statistics.mean(speeds),
+        })
+        logging.info(f'Бенчмарк декодирования {name}: {results[-1]}')
+
+    generator.draft_model = draft_model
+    return results
+
+def run_concurrency_benchmark(questions, levels = DEFAULT_CONCURRENCY_LEVELS, requests_per_level = None):
+    '''
+    Замеряет пропускную способность и задержку run_rag_query при разном числе одновременных запросов
+    с менеджером ресурсов и без него.
+
+    Args:
+        questions (list): Список вопросов (используются по кругу).
+        levels (tuple): Количество одновременных запросов.
+        requests_per_level (int): Сколько запросов выполнить на каждом уровне
+                                  (по умолчанию - вдвое больше уровня параллельности).
+
+    Returns:
+        list: Словари с результатами для каждой пары (уровень, режим).
+    '''
+    # Загружаем модели заранее, чтобы загрузка не попала в замеры
+    rag_main.get_rag_components()
+    manager = rag_main.resource_manager
+    results = []
+
+    for managed in (False, True):
+        manager.enabled = managed
+
+        for level in levels:
+            total_requests = requests_per_level or max(2 * level, len(questions))
+            batch = [questions[i % len(questions)] for i in range(total_requests)]
+
+            def timed_query(question):
+                start = time.perf_counter()
+                rag_main.run_rag_query(question)
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers = level) as executor:
+                latencies = list(executor.map(timed_query, batch))
+            elapsed = time.perf_counter() - start
+
+            # quantiles с method='inclusive' дает перцентили от 1 до 99
+            quantiles = statistics.quantiles(latencies, n = 100, method = 'inclusive')
+            results.append({
+                'mode': 'managed' if managed else 'default',
+                'concurrency': level,
+                'requests': total_requests,
+                'throughput': total_requests / elapsed,
+                'p50_latency': quantiles[49],
+                'p95_latency': quantiles[94],
+            })
+            logging.info(f'Бенчмарк параллельности: {results[-1]}, этапы: {manager.get_stats()}')
+
+    manager.enabled = True
+    return results
+
+def print_concurrency_results(results):
+    '''Выводит таблицу с результатами бенчмарка параллельности.'''
+    print(f"{'режим':<10}{'параллельно':>13}{'запросов':>10}{'запр/с':>10}{'p50, с':>10}{'p95, с':>10}")
+
+    for row in results:
+        print(
+            f"{row['mode']:<10}{row['concurrency']:>13}{row['requests']:>10}{row['throughput']:>10.2f}"
+            f"{row['p50_latency']:>10.2f}{row['p95_latency']:>10.2f}"
+        )
+
+def print_results(results):
+    '''Выводит таблицу с результатами бенчмарка.'''
+    print(f"{'режим':<16}{'запросов':>10}{'задержка, с':>14}{'макс, с':>10}{'токенов':>10}{'ток/с':>10}")
+
+    for row in results:
+        print(
+            f"{row['mode']:<16}{row['requests']:>10}{row['mean_latency']:>14.2f}"
+            f"{row['max_latency']:>10.2f}{row['mean_tokens']:>10.1f}{row['tokens_per_second']:>10.1f}"
+        )
+
+def main():
+    '''Запускает бенчмарки режимов декодирования и распределения ресурсов.'''
+    parser = argparse.ArgumentParser(description = 'Бенчмарк генерации RAG-системы')
+    parser.add_argument('--draft-model', default = None,
+                        help = 'Черновая модель для assisted-декодирования (тот же токенизатор, что у Qwen)')
+    parser.add_argument('--repeats', type = int, default = 1, help = 'Количество повторов каждого вопроса')
+    parser.add_argument('--suite', choices = ['decoding', 'concurrency', 'all'], default = 'all',
+                        help = 'Какие бенчмарки запускать')
+    parser.add_argument('--levels', type = int, nargs = '+', default = list(DEFAULT_CONCURRENCY_LEVELS),
+                        help = 'Уровни параллельности для бенчмарка ресурсов')
+    args = parser.parse_args()
+
+    if args.suite in ('decoding', 'all'):
+        contexts = retrieve_contexts(DEFAULT_QUESTIONS)
+
+        generator = Generator(draft_model_name = args.draft_model)
+        generator.initialize_generator()
+
+        results = run_decoding_benchmark(generator, DEFAULT_QUESTIONS, contexts, args.repeats)
+        print_results(results)
+
+    if args.suite in ('concurrency', 'all'):
+        results = run_concurrency_benchmark(DEFAULT_QUESTIONS, tuple(args.levels))
+        print_concurrency_results(results)
+
+# Точка входа в программу
+if __name__ == "__main__":
+    main()
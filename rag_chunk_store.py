@@ -0,0 +1,355 @@
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+
+# Настройка логирования для хранилища чанков
+logging.basicConfig(
+    filename = 'rag_debug.log',
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s',
+    encoding = 'utf-8',
+)
+
+class ChunkStore:
+    """
+    Append-only хранилище текстов чанков: бинарный файл с текстами (UTF-8),
+    отображаемый в память (mmap), и таблица смещений, адресуемая по ID чанка.
+
+    Каждая переиндексация пишет новое поколение в отдельный файл с текстами.
+    Смещения дописанных чанков накапливаются в памяти, а таблица смещений публикуется
+    один раз при commit() и атомарно заменяется через os.replace. Процессы, которые уже
+    читают старое поколение, продолжают работать со своим файлом и могут перейти
+    на новое поколение вызовом refresh().
+    """
+    OFFSETS_FILENAME = 'offsets.json'
+
+    def __init__(self, persist_directory = 'chunk_store'):
+        '''
+        Инициализирует хранилище чанков.
+
+        Args:
+            persist_directory (str): Путь к папке для хранения текстов и таблицы смещений.
+        '''
+        self.persist_directory = persist_directory
+        self.offsets_path = os.path.join(persist_directory, self.OFFSETS_FILENAME)
+        self.generation = 0
+        self.blob_filename = None
+        # Таблица смещений (ID чанка -> (смещение в байтах, длина в байтах)) и отображение файла
+        # меняются одним присваиванием, чтобы потоки-читатели всегда видели согласованную пару
+        self._state = ({}, None)
+        # Идентификатор файла таблицы смещений, по которому refresh() замечает новое поколение
+        self._index_key = None
+        # Таблица смещений, которая еще пишется и не опубликована (None - записи нет)
+        self._pending_offsets = None
+        self._lock = threading.Lock()
+        logging.info(f'Инициализация ChunkStore в папке: {persist_directory}')
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._state[0]
+
+    @property
+    def offsets(self):
+        '''dict: Таблица смещений текущего поколения.'''
+        return self._state[0]
+
+    @property
+    def blob_path(self):
+        '''str: Путь к файлу с текстами текущего поколения.'''
+        return os.path.join(self.persist_directory, self.blob_filename)
+
+    def exists(self):
+        '''
+        Проверяет, что хранилище уже создано на диске.
+
+        Returns:
+            bool: True, если таблица смещений существует.
+        '''
+        return os.path.exists(self.offsets_path)
+
+    def open(self):
+        '''Загружает таблицу смещений и отображает файл с текстами в память.'''
+        os.makedirs(self.persist_directory, exist_ok = True)
+
+        # Создаем пустое первое поколение при первом открытии
+        if not self.exists():
+            self._start_generation(1)
+            self._save_offsets({})
+
+        with self._lock:
+            self._load()
+
+        logging.info(f'ChunkStore открыт: поколение {self.generation}, {len(self)} чанков')
+
+    def refresh(self):
+        '''
+        Переоткрывает хранилище, если с момента загрузки была опубликована новая таблица смещений
+        (например, после переиндексации в другом процессе).
+
+        Returns:
+            bool: True, если загружено новое состояние.
+        '''
+        key = self._get_index_key()
+        if key is None or key == self._index_key:
+            return False
+
+        with self._lock:
+            if self._get_index_key() == self._index_key:
+                return False
+            self._load()
+
+        logging.info(f'ChunkStore обновлен: поколение {self.generation}, {len(self)} чанков')
+        return True
+
+    def close(self):
+        '''Закрывает отображение файла в память. Неопубликованные дозаписи отбрасываются.'''
+        self._pending_offsets = None
+        offsets, data = self._state
+        self._state = (offsets, None)
+        self._close_mapping(data)
+
+    def reset(self):
+        '''
+        Начинает новое поколение хранилища (используется перед полной переиндексацией).
+        Текущий файл с текстами не изменяется: новое поколение пишется в отдельный файл
+        и становится видимым читателям только после commit().
+        '''
+        os.makedirs(self.persist_directory, exist_ok = True)
+
+        current_generation = self.generation
+        if self.exists():
+            current_generation = max(current_generation, self._read_index()[0])
+
+        self.close()
+        self._start_generation(current_generation + 1)
+        self._state = ({}, None)
+        self._pending_offsets = {}
+
+        logging.info(f'ChunkStore: начато поколение {self.generation}')
+
+    def append_chunks(self, ids, chunks):
+        '''
+        Дописывает чанки в конец хранилища. Чанки становятся видимыми после commit().
+        Если чанк с таким ID уже есть, таблица смещений начинает указывать на новую запись.
+
+        Args:
+            ids (list): Список ID чанков (те же, что в ChromaDB).
+            chunks (list): Список текстов чанков.
+        '''
+        if len(ids) != len(chunks):
+            raise ValueError('Количество ID не совпадает с количеством чанков')
+
+        if self.blob_filename is None:
+            self.open()
+
+        with self._lock:
+            if self._pending_offsets is None:
+                # Дозапись в текущее поколение: новая таблица начинается с опубликованной
+                self._pending_offsets = dict(self._state[0])
+
+            # Дозапись в конец не меняет уже записанные байты, поэтому отображения у читателей остаются верными
+            with open(self.blob_path, 'ab') as f:
+                offset = f.tell()
+                for chunk_id, chunk in zip(ids, chunks):
+                    data = chunk.encode('utf-8')
+                    f.write(data)
+                    self._pending_offsets[chunk_id] = (offset, len(data))
+                    offset += len(data)
+
+        logging.info(f'В ChunkStore дописано {len(ids)} чанков')
+
+    def commit(self):
+        '''
+        Публикует дописанные чанки: атомарно заменяет таблицу смещений и переходит на нее.
+        Вызывается один раз после записи всех документов, чтобы читатели не видели неполное поколение.
+        '''
+        with self._lock:
+            if self._pending_offsets is None:
+                return
+
+            self._save_offsets(self._pending_offsets)
+            self._pending_offsets = None
+            self._load()
+
+        self._remove_stale_blobs()
+        logging.info(f'ChunkStore: опубликовано поколение {self.generation}, {len(self)} чанков')
+
+    def get_chunk_bytes(self, chunk_id):
+        '''
+        Возвращает байты чанка без копирования.
+        Срез остается действительным и после дозаписи или перехода на новое поколение.
+
+        Args:
+            chunk_id (str): ID чанка.
+
+        Returns:
+            memoryview: Срез отображенного в память файла с текстом чанка в UTF-8.
+
+        Raises:
+            ValueError: Если хранилище не открыто.
+            KeyError: Если чанк не найден.
+        '''
+        offsets, data = self._state
+
+        if data is None and offsets:
+            raise ValueError('Хранилище не открыто. Вызовите open()')
+
+        offset, length = offsets[chunk_id]
+
+        if length == 0:
+            return memoryview(b'')
+
+        return memoryview(data)[offset:offset + length]
+
+    def get_chunk(self, chunk_id):
+        '''
+        Возвращает текст чанка по его ID.
+
+        Args:
+            chunk_id (str): ID чанка.
+
+        Returns:
+            str: Текст чанка.
+        '''
+        return str(self.get_chunk_bytes(chunk_id), 'utf-8')
+
+    def get_chunks(self, ids):
+        '''
+        Возвращает тексты нескольких чанков в порядке переданных ID.
+
+        Args:
+            ids (list): Список ID чанков.
+
+        Returns:
+            list: Список текстов чанков.
+        '''
+        return [self.get_chunk(chunk_id) for chunk_id in ids]
+
+    def import_from_collection(self, collection, batch_size = 1000):
+        '''
+        Заполняет хранилище текстами из коллекции ChromaDB.
+        Используется, когда база уже проиндексирована, а хранилище чанков еще не создано.
+
+        Args:
+            collection: Коллекция ChromaDB.
+            batch_size (int): Количество чанков, читаемых за один запрос.
+        '''
+        logging.info('Импорт чанков из ChromaDB в ChunkStore')
+        self.reset()
+
+        offset = 0
+        while True:
+            batch = collection.get(include = ['documents'], limit = batch_size, offset = offset)
+            if not batch['ids']:
+                break
+
+            self.append_chunks(batch['ids'], batch['documents'])
+            offset += len(batch['ids'])
+
+        self.commit()
+        logging.info(f'Импортировано {len(self)} чанков')
+
+    def _start_generation(self, generation):
+        '''Создает пустой файл с текстами для нового поколения.'''
+        self.generation = generation
+        self.blob_filename = f'chunks-{generation}.bin'
+        open(self.blob_path, 'wb').close()
+
+    def _read_index(self):
+        '''
+        Читает таблицу смещений с диска.
+
+        Returns:
+            tuple: (поколение, имя файла с текстами, таблица смещений).
+        '''
+        with open(self.offsets_path, 'r', encoding = 'utf-8') as f:
+            index = json.load(f)
+
+        offsets = {chunk_id: tuple(position) for chunk_id, position in index['offsets'].items()}
+        return index['generation'], index['blob'], offsets
+
+    def _load(self, attempts = 3):
+        '''
+        Загружает таблицу смещений и отображает ее файл с текстами (вызывается под блокировкой).
+        Таблица читается первой: файл с текстами к этому моменту уже содержит все ее записи.
+        '''
+        for attempt in range(attempts):
+            key = self._get_index_key()
+            generation, blob_filename, offsets = self._read_index()
+
+            try:
+                data = self._map(os.path.join(self.persist_directory, blob_filename))
+                break
+            except FileNotFoundError:
+                # Поколение успели заменить и удалить между чтением таблицы и открытием файла
+                if attempt + 1 == attempts:
+                    raise
+
+        # Старое отображение не закрываем явно: другой поток может еще читать из него.
+        # Оно закроется само, когда на него не останется ссылок
+        self.generation = generation
+        self.blob_filename = blob_filename
+        self._index_key = key
+        self._state = (offsets, data)
+
+    def _save_offsets(self, offsets):
+        '''Атомарно публикует таблицу смещений текущего поколения.'''
+        tmp_path = self.offsets_path + '.tmp'
+
+        with open(tmp_path, 'w', encoding = 'utf-8') as f:
+            json.dump({'generation': self.generation, 'blob': self.blob_filename, 'offsets': offsets}, f, ensure_ascii = False)
+
+        os.replace(tmp_path, self.offsets_path)
+
+    def _get_index_key(self):
+        '''Возвращает идентификатор файла таблицы смещений (меняется при каждой публикации).'''
+        try:
+            stat = os.stat(self.offsets_path)
+        except FileNotFoundError:
+            return None
+
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _remove_stale_blobs(self):
+        '''
+        Удаляет файлы с текстами старых поколений.
+        Процессы, которые их еще отображают, продолжают читать данные: файл освобождается после закрытия.
+        '''
+        pattern = re.compile(r'chunks-\d+\.bin')
+
+        for filename in os.listdir(self.persist_directory):
+            if filename == self.blob_filename or not pattern.fullmatch(filename):
+                continue
+
+            try:
+                os.remove(os.path.join(self.persist_directory, filename))
+            except OSError:
+                # В Windows отображенный файл удалить нельзя, он будет удален в следующий раз
+                pass
+
+    @staticmethod
+    def _map(path):
+        '''Отображает файл в память (пустой файл отобразить нельзя).'''
+        if os.path.getsize(path) == 0:
+            return None
+
+        # mmap хранит собственную копию дескриптора, поэтому файл можно сразу закрыть
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    @staticmethod
+    def _close_mapping(data):
+        '''Закрывает отображение, если на него не осталось срезов.'''
+        if data is None:
+            return
+
+        try:
+            data.close()
+        except BufferError:
+            # Срезы (memoryview) еще используются: отображение закроется, когда они будут освобождены
+            pass
@@ -1,6 +1,10 @@
+import copy
 import logging
+import re
+import threading
+import time
 import torch
-from transformers import pipeline
+from transformers import AutoModelForCausalLM, DynamicCache, StoppingCriteria, StoppingCriteriaList, pipeline
 
 # Настройка логирования для отслеживания работы генератора
 logging.basicConfig(
@@ -10,54 +14,286 @@ logging.basicConfig(
     encoding = 'utf-8',
 )
 
+# Строки, после которых модель начинает "продолжать" промпт вместо ответа
+DEFAULT_STOP_STRINGS = ('\nВопрос:', '\nКонтекст:', '\nОтвет на русском языке:')
+
+# Параметры сэмплирования при генерации ответа
+SAMPLING_PARAMS = {
+    'temperature': 0.7, # Контроль креативности (0 - детерминировано, 1+ - креативно)
+    'top_p': 0.9, # Nucleus sampling - ограничивает выбор токенов по вероятности
+    'repetition_penalty': 1.2, # Штраф за повторение токенов
+    'do_sample': True, # Использовать сэмплинг вместо жадного поиска
+}
+
+# Символы, которыми заканчивается предложение
+SENTENCE_END_CHARS = ('.', '!', '?', '…')
+
+# Лимиты генерируемых токенов в зависимости от типа вопроса
+MAX_NEW_TOKENS_BY_QUESTION_TYPE = {
+    'short': 80, # Короткие фактические вопросы: "что такое", "сколько", "есть ли"
+    'default': 150, # Обычные вопросы
+    'long': 250, # Вопросы, требующие объяснения или примеров
+}
+
+# Начала вопросов и слова для определения типа вопроса (сравниваются целыми словами,
+# чтобы "например" не считалось словом "пример", а "так как" - вопросом "как")
+# "какие"/"какой" сюда не входят: ответом на них часто бывает перечисление
+SHORT_QUESTION_PREFIXES = ('что такое', 'что значит', 'какая', 'какое', 'сколько', 'есть ли', 'можно ли')
+LONG_QUESTION_PREFIXES = ('как', 'в чем разница', 'чем отличается', 'чем отличаются')
+LONG_QUESTION_WORDS = ('почему', 'зачем', 'объясни', 'расскажи', 'сравни', 'пример', 'примеры', 'примером',
+                       'разница', 'разницу', 'отличие', 'отличия', 'отличается', 'отличаются')
+
+
+class StopOnTextCriteria(StoppingCriteria):
+    """Критерий остановки генерации по стоп-строкам и/или по концу предложения."""
+    def __init__(self, tokenizer, prompt_length, stop_strings = (), max_sentences = None, lookback_tokens = 16):
+        '''
+        Инициализирует критерий остановки.
+
+        Args:
+            tokenizer: Токенизатор модели для декодирования сгенерированных токенов.
+            prompt_length (int): Длина промпта в токенах (сгенерированная часть идет после нее).
+            stop_strings (tuple): Строки, при появлении которых генерация прекращается.
+            max_sentences (int): Остановиться после указанного числа законченных предложений.
+                                 Если None, проверка конца предложения не выполняется.
+            lookback_tokens (int): Сколько последних токенов декодировать для поиска стоп-строк.
+        '''
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_strings = tuple(stop_strings)
+        self.max_sentences = max_sentences
+        self.lookback_tokens = lookback_tokens
+        # Количество сгенерированных токенов на последнем шаге (используется для замеров скорости)
+        self.generated_tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        '''
+        Проверяет, нужно ли остановить генерацию.
+
+        Returns:
+            torch.BoolTensor: Флаг остановки для каждой последовательности в батче.
+        '''
+        self.generated_tokens = input_ids.shape[1] - self.prompt_length
+        is_done = torch.zeros(input_ids.shape[0], dtype = torch.bool, device = input_ids.device)
+
+        if self.generated_tokens <= 0:
+            return is_done
+
+        for i, sequence in enumerate(input_ids):
+            generated = sequence[self.prompt_length:]
+
+            # Для стоп-строк достаточно хвоста сгенерированного текста
+            if self.stop_strings:
+                tail = self.tokenizer.decode(generated[-self.lookback_tokens:], skip_special_tokens = True)
+                if any(stop in tail for stop in self.stop_strings):
+                    is_done[i] = True
+                    continue
+
+            # Для подсчета предложений декодируем весь ответ только когда он заканчивается знаком конца предложения
+            if self.max_sentences:
+                last_token = self.tokenizer.decode(generated[-1:], skip_special_tokens = True).rstrip()
+                if last_token.endswith(SENTENCE_END_CHARS):
+                    text = self.tokenizer.decode(generated, skip_special_tokens = True)
+                    if count_sentences(text) >= self.max_sentences:
+                        is_done[i] = True
+
+        return is_done
+
+
+def count_sentences(text):
+    '''
+    Подсчитывает количество законченных предложений в тексте.
+
+    Args:
+        text (str): Текст для анализа.
+
+    Returns:
+        int: Количество предложений, заканчивающихся знаком конца предложения.
+    '''
+    count = 0
+    stripped = text.strip()
+
+    for i, char in enumerate(stripped):
+        if char in SENTENCE_END_CHARS:
+            # Считаем концом предложения знак, за которым идет пробел или конец текста
+            # (так "3.14" или "os.path" не считаются концом предложения)
+            if i + 1 == len(stripped) or stripped[i + 1].isspace():
+                count += 1
+
+    return count
+
+
+def classify_question(query):
+    '''
+    Определяет тип вопроса для выбора лимита генерируемых токенов.
+
+    Args:
+        query (str): Вопрос пользователя.
+
+    Returns:
+        str: 'short', 'long' или 'default'.
+    '''
+    words = re.findall(r'\w+', query.lower())
+    # Пробел в конце, чтобы начало сравнивалось целыми словами ("как" не совпадает с "какая")
+    normalized = ' '.join(words) + ' '
+
+    if normalized.startswith(tuple(prefix + ' ' for prefix in LONG_QUESTION_PREFIXES)):
+        return 'long'
+
+    if any(word in LONG_QUESTION_WORDS for word in words):
+        return 'long'
+
+    if normalized.startswith(tuple(prefix + ' ' for prefix in SHORT_QUESTION_PREFIXES)):
+        return 'short'
+
+    return 'default'
+
+
+def trim_at_stop_strings(text, stop_strings):
+    '''
+    Обрезает текст по первой найденной стоп-строке.
+
+    Args:
+        text (str): Сгенерированный текст.
+        stop_strings (tuple): Стоп-строки.
+
+    Returns:
+        str: Текст до первой стоп-строки.
+    '''
+    cut = len(text)
+
+    for stop in stop_strings:
+        position = text.find(stop)
+        if position != -1:
+            cut = min(cut, position)
+
+    return text[:cut]
+
+
+def build_session_prefix(context, history):
+    '''
+    Формирует неизменяемую часть промпта для сессии: контекст и историю диалога.
+    Контекст идет первым: пока тема разговора не меняется, новый префикс начинается так же,
+    как предыдущий (даже когда из окна истории уходит старый обмен), поэтому KV-кэш модели
+    для общего начала переиспользуется, а не считается заново.
+
+    Args:
+        context (str): Объединенный текст найденных чанков.
+        history (iterable): Пары (вопрос, ответ) предыдущих сообщений.
+
+    Returns:
+        str: Префикс промпта, заканчивающийся переводом строки.
+    '''
+    prefix = f"Контекст: {context}\n"
+
+    for question, answer in history:
+        prefix += f"Вопрос: {question}\nОтвет: {answer}\n"
+
+    return prefix
+
+
 class Generator:
     """Класс для генерации ответов на вопросы пользователя на основе найденного контекста."""
-    def __init__(self, model_name = "Qwen/Qwen3-0.6B"):
+    def __init__(self, model_name = "Qwen/Qwen3-0.6B", stop_strings = DEFAULT_STOP_STRINGS,
+                 max_sentences = None, adaptive_max_tokens = False, draft_model_name = None):
         '''
         Инициализирует генератор с указанной моделью.
 
         Args:
             model_name (str): Идентификатор модели на Hugging Face.
                               По умолчанию используется Qwen/Qwen3-0.6B.
+            stop_strings (tuple): Строки, на которых генерация прекращается.
+            max_sentences (int): Остановка после указанного числа предложений (None - без ограничения).
+            adaptive_max_tokens (bool): Подбирать max_new_tokens по типу вопроса.
+            draft_model_name (str): Маленькая черновая модель для assisted (спекулятивного) декодирования.
+                                    Должна использовать тот же токенизатор, что и основная модель.
+                                    Если None, используется обычное декодирование.
         '''
         self.model_name = model_name
+        self.stop_strings = tuple(stop_strings or ())
+        self.max_sentences = max_sentences
+        self.adaptive_max_tokens = adaptive_max_tokens
+        self.draft_model_name = draft_model_name
         self.generator = None
+        self.draft_model = None
+        # Статистика последней генерации хранится отдельно для каждого потока:
+        # один генератор обслуживает одновременные запросы из нескольких потоков
+        self._local = threading.local()
         logging.info(f'Generator инициализирован с моделью: {model_name}')
 
+    @property
+    def last_generation_stats(self):
+        '''dict: Статистика последней генерации в текущем потоке (токены, время, скорость) или None.'''
+        return getattr(self._local, 'generation_stats', None)
+
+    @last_generation_stats.setter
+    def last_generation_stats(self, stats):
+        self._local.generation_stats = stats
+
     def initialize_generator(self):
         '''
         Загружает и инициализирует генеративную модель через transformers.pipeline.
         Модель загружается в автоматически определяемое устройство (GPU/CPU).
+        Если указана черновая модель, она загружается на то же устройство.
         '''
         try:
+            # Используем float16 для GPU (экономия памяти), float32 для CPU
+            torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+
             # Создание пайплайна для генерации текста
             self.generator = pipeline(
                 "text-generation", # Тип задачи: генерация текста
                 model = self.model_name, # Имя модели
-                # Используем float16 для GPU (экономия памяти), float32 для CPU
-                torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32,
+                torch_dtype = torch_dtype,
                 # Автоматический выбор устройства (GPU если доступен)
                 device_map="auto" if torch.cuda.is_available() else None,
                 # Необходимо для моделей с пользовательским кодом
                 trust_remote_code = True
             )
 
+            # Черновая модель предлагает токены, основная модель проверяет их за один проход
+            if self.draft_model_name:
+                self.draft_model = AutoModelForCausalLM.from_pretrained(
+                    self.draft_model_name,
+                    torch_dtype = torch_dtype,
+                    trust_remote_code = True
+                ).to(self.generator.model.device)
+                logging.info(f'Черновая модель для assisted-декодирования загружена: {self.draft_model_name}')
+
             logging.info('Генеративная модель инициализирована успешно')
 
         except Exception as e:
             logging.error(f'Ошибка при инициализации генератора: {str(e)}')
             raise
 
-    def generate_answer(self, query, relevant_chunks):
+    def get_max_new_tokens(self, query):
+        '''
+        Возвращает лимит генерируемых токенов для вопроса.
+
+        Args:
+            query (str): Вопрос пользователя.
+
+        Returns:
+            int: Максимальное количество новых токенов.
+        '''
+        if not self.adaptive_max_tokens:
+            return MAX_NEW_TOKENS_BY_QUESTION_TYPE['default']
+
+        return MAX_NEW_TOKENS_BY_QUESTION_TYPE[classify_question(query)]
+
+    def generate_answer(self, query, relevant_chunks, session = None):
         '''
         Генерирует ответ на вопрос пользователя, используя найденный контекст.
+        Статистика генерации сохраняется в self.last_generation_stats (отдельно для каждого потока).
 
         Args:
             query (str): Вопрос пользователя.
             relevant_chunks (list): Список релевантных текстовых фрагментов из БД.
+            session (Session): Сессия чата. Если передана, в промпт добавляется история диалога,
+                               а KV-кэш префикса промпта сохраняется в сессии и переиспользуется.
 
         Returns:
-            str: Сгенерированный ответ на русском языке.
+            str: Сгенерированный ответ на русском языке (пустая строка, если модель не сформулировала ответ).
 
         Raises:
             ValueError: Если модель не была инициализирована.
@@ -72,30 +308,41 @@ class Generator:
             # Объединяем найденные релевантные фрагменты в один контекст
             context = "\n".join(relevant_chunks)
 
-            # Формируем промпт для модели
-            # Модель будет использовать этот текст как основу для генерации ответа
-            prompt = f"Вопрос: {query}\nКонтекст: {context}\nОтвет на русском языке:"
-
-            # Генерация ответа с заданными параметрами
-            response = self.generator(
-                prompt, # Входной текст (промпт)
-                max_new_tokens = 150, # Максимальное количество генерируемых токенов
-                temperature = 0.7, # Контроль креативности (0 - детерминировано, 1+ - креативно)
-                top_p = 0.9, # Nucleus sampling - ограничивает выбор токенов по вероятности
-                repetition_penalty = 1.2, # Штраф за повторение токенов
-                do_sample = True # Использовать сэмплинг вместо жадного поиска
-            )
+            max_new_tokens = self.get_max_new_tokens(query)
+
+            start_time = time.perf_counter()
 
-            # Извлекаем только сгенерированную часть ответа
-            # Убираем исходный промпт из результата
-            full_text = response[0]['generated_text']
-            answer = full_text[len(prompt):].strip()
+            if session is None:
+                # Формируем промпт для модели
+                # Модель будет использовать этот текст как основу для генерации ответа
+                prompt = f"Вопрос: {query}\nКонтекст: {context}\nОтвет на русском языке:"
+                answer, prompt_length, generated_tokens, assisted = self._generate_with_pipeline(prompt, max_new_tokens)
+                cached_tokens = 0
+            else:
+                # Контекст и история идут первыми, чтобы начало промпта совпадало между сообщениями
+                prompt_prefix = build_session_prefix(context, session.history)
+                prompt = prompt_prefix + f"Вопрос: {query}\nОтвет на русском языке:"
+                answer, prompt_length, generated_tokens, cached_tokens, assisted = self._generate_with_prompt_cache(
+                    prompt_prefix, prompt, session, max_new_tokens
+                )
 
-            # Резервный вариант, если извлечение по длине не сработало
-            if not answer:
-                answer = full_text.strip()
+            latency = time.perf_counter() - start_time
 
-            logging.info('Ответ сгенерирован успешно')
+            self.last_generation_stats = {
+                'prompt_tokens': prompt_length,
+                'cached_prompt_tokens': cached_tokens,
+                'generated_tokens': generated_tokens,
+                'max_new_tokens': max_new_tokens,
+                'latency': latency,
+                'tokens_per_second': generated_tokens / latency if latency > 0 else 0.0,
+                'assisted': assisted,
+            }
+
+            logging.info(
+                f'Ответ сгенерирован успешно: {generated_tokens} токенов за {latency:.2f} с '
+                f'({self.last_generation_stats["tokens_per_second"]:.1f} ток/с, '
+                f'из кэша {cached_tokens} из {prompt_length} токенов промпта)'
+            )
 
             # Возвращаем только сгенерированный ответ, без контекста
             return answer
@@ -103,3 +350,150 @@ class Generator:
         except Exception as e:
             logging.error(f'Ошибка при генерации ответа: {str(e)}')
             raise
+
+    def _make_stop_criteria(self, prompt_length):
+        '''Создает критерий остановки по стоп-строкам и концу предложения.'''
+        return StopOnTextCriteria(
+            self.generator.tokenizer,
+            prompt_length,
+            stop_strings = self.stop_strings,
+            max_sentences = self.max_sentences
+        )
+
+    def _generate_with_pipeline(self, prompt, max_new_tokens):
+        '''
+        Генерирует ответ через pipeline без сохранения состояния между запросами.
+
+        Returns:
+            tuple: (ответ, длина промпта в токенах, количество сгенерированных токенов,
+                    использовалась ли черновая модель).
+        '''
+        prompt_length = len(self.generator.tokenizer(prompt)['input_ids'])
+        stop_criteria = self._make_stop_criteria(prompt_length)
+
+        generate_kwargs = {}
+        if self.draft_model is not None:
+            generate_kwargs['assistant_model'] = self.draft_model
+
+        # Генерация ответа с заданными параметрами
+        response = self.generator(
+            prompt, # Входной текст (промпт)
+            max_new_tokens = max_new_tokens, # Максимальное количество генерируемых токенов
+            stopping_criteria = StoppingCriteriaList([stop_criteria]), # Ранняя остановка
+            **SAMPLING_PARAMS,
+            **generate_kwargs
+        )
+
+        # Извлекаем только сгенерированную часть ответа
+        # Убираем исходный промпт из результата
+        full_text = response[0]['generated_text']
+        answer = full_text[len(prompt):]
+
+        # Стоп-строка уже попала в ответ к моменту остановки, поэтому обрезаем по ней.
+        # Если модель сразу начала продолжать промпт, ответ пустой: промпт с контекстом
+        # пользователю не возвращаем, бот ответит сообщением об отсутствии ответа
+        answer = trim_at_stop_strings(answer, self.stop_strings).strip()
+
+        return answer, prompt_length, stop_criteria.generated_tokens, 'assistant_model' in generate_kwargs
+
+    def _generate_with_prompt_cache(self, prompt_prefix, prompt, session, max_new_tokens):
+        '''
+        Генерирует ответ, переиспользуя KV-кэш префикса промпта из сессии.
+        Модель обрабатывает только токены, которых еще нет в кэше.
+
+        Returns:
+            tuple: (ответ, длина промпта в токенах, количество сгенерированных токенов,
+                    количество токенов промпта, взятых из кэша, использовалась ли черновая модель).
+        '''
+        tokenizer = self.generator.tokenizer
+        model = self.generator.model
+
+        prefix_ids = tokenizer(prompt_prefix, return_tensors = 'pt')['input_ids'].to(model.device)
+        input_ids = tokenizer(prompt, return_tensors = 'pt')['input_ids'].to(model.device)
+        prefix_length = prefix_ids.shape[1]
+        prompt_length = input_ids.shape[1]
+
+        generate_kwargs = {}
+        cached_tokens = 0
+
+        # Кэш применим, только если токены префикса совпадают с началом токенов полного промпта
+        if prefix_length < prompt_length and torch.equal(input_ids[0, :prefix_length], prefix_ids[0]):
+            prefix_cache, cached_tokens = self._get_prefix_cache(session, prefix_ids)
+            # generate дописывает в кэш, поэтому передаем копию, а в сессии остается только префикс
+            generate_kwargs['past_key_values'] = copy.deepcopy(prefix_cache)
+        else:
+            session.prompt_cache = None
+            if self.draft_model is not None:
+                generate_kwargs['assistant_model'] = self.draft_model
+
+        stop_criteria = self._make_stop_criteria(prompt_length)
+
+        with torch.no_grad():
+            output = model.generate(
+                input_ids = input_ids,
+                attention_mask = torch.ones_like(input_ids),
+                max_new_tokens = max_new_tokens,
+                stopping_criteria = StoppingCriteriaList([stop_criteria]),
+                pad_token_id = tokenizer.pad_token_id or tokenizer.eos_token_id,
+                **SAMPLING_PARAMS,
+                **generate_kwargs
+            )
+
+        answer = tokenizer.decode(output[0, prompt_length:], skip_special_tokens = True)
+        answer = trim_at_stop_strings(answer, self.stop_strings).strip()
+
+        return answer, prompt_length, output.shape[1] - prompt_length, cached_tokens, 'assistant_model' in generate_kwargs
+
+    def _get_prefix_cache(self, session, prefix_ids):
+        '''
+        Возвращает KV-кэш для префикса промпта, переиспользуя общее начало с кэшем сессии.
+        Когда из окна истории уходит самый старый обмен, совпадают только контекст и
+        начало истории: кэш обрезается до общей части, и модель обрабатывает только остаток.
+
+        Args:
+            session (Session): Сессия чата с полем prompt_cache.
+            prefix_ids (torch.Tensor): Токены префикса промпта.
+
+        Returns:
+            tuple: (DynamicCache для всего префикса, количество токенов, взятых из кэша сессии).
+        '''
+        model = self.generator.model
+        entry = session.prompt_cache
+        prefix_length = prefix_ids.shape[1]
+        reused_tokens = 0
+        cache = None
+
+        if entry is not None:
+            cached_ids = entry['input_ids']
+            common_length = min(cached_ids.shape[1], prefix_length)
+
+            # Длина общего начала закэшированных и новых токенов
+            mismatches = (cached_ids[0, :common_length] != prefix_ids[0, :common_length]).nonzero()
+            if len(mismatches):
+                common_length = int(mismatches[0, 0])
+
+            if common_length > 0:
+                cache = entry['past_key_values']
+                reused_tokens = common_length
+
+                # Кэш модели причинный, поэтому значения для общего начала не зависят от того, что шло после него
+                if cached_ids.shape[1] > common_length:
+                    # Отрицательное значение - сколько токенов убрать с конца (поддерживается всеми версиями transformers)
+                    cache.crop(common_length - cached_ids.shape[1])
+                    session.prompt_cache = {'input_ids': prefix_ids[:, :common_length], 'past_key_values': cache}
+
+                if common_length == prefix_length:
+                    return cache, reused_tokens
+
+        new_ids = prefix_ids[:, reused_tokens:]
+
+        # Прогоняем через модель только новые токены префикса
+        with torch.no_grad():
+            output = model(
+                input_ids = new_ids,
+                past_key_values = cache if cache is not None else DynamicCache(),
+                use_cache = True
+            )
+
+        session.prompt_cache = {'input_ids': prefix_ids, 'past_key_values': output.past_key_values}
+        return output.past_key_values, reused_tokens
@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telegram_bot
+
+# Настройка логирования для нагрузочного тестирования
+logging.basicConfig(
+    filename = 'rag_loadtest.log',
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s',
+    encoding = 'utf-8'
+)
+
+# Набор вопросов по умолчанию: (вопрос, вес)
+DEFAULT_QUESTION_MIX = [
+    ('Что такое кортеж в Python?', 3),
+    ('Какие есть типы данных в Python?', 3),
+    ('Как работает оператор with?', 2),
+    ('Чем список отличается от кортежа?', 2),
+    ('Почему в Python числа с плавающей точкой неточны?', 1),
+    ('Расскажи про виртуальные окружения', 1),
+    ('Как импортировать модуль из пакета?', 1),
+]
+
+# Ответы бота, которые считаются ошибкой обработки
+ERROR_REPLIES = (telegram_bot.ERROR_MESSAGE, telegram_bot.UNAVAILABLE_MESSAGE, telegram_bot.NO_ANSWER_MESSAGE)
+
+
+class FakeUser:
+    """Заглушка telegram.User с полями, которые используют обработчики бота."""
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f'Пользователь {user_id}'
+        self.username = f'loadtest_user_{user_id}'
+
+
+class FakeChat:
+    """Заглушка telegram.Chat: действия в чате только подсчитываются."""
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.actions = 0
+
+    async def send_action(self, action, **kwargs):
+        self.actions += 1
+
+
+class FakeMessage:
+    """Заглушка telegram.Message: ответы бота сохраняются вместо отправки в Telegram."""
+    def __init__(self, text, chat, user):
+        self.text = text
+        self.chat = chat
+        self.chat_id = chat.id
+        self.from_user = user
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((time.perf_counter(), text))
+
+
+class FakeUpdate:
+    """Заглушка telegram.Update с одним текстовым сообщением."""
+    def __init__(self, message):
+        self.message = message
+        self.effective_message = message
+        self.effective_chat = message.chat
+        self.effective_user = message.from_user
+
+
+class FakeContext:
+    """Заглушка контекста обработчика с данными бота, чата и пользователя, как в Application."""
+    def __init__(self, application, chat_id, user_id):
+        self.application = application
+        self.bot_data = application.bot_data
+        self.chat_data = application.chat_data.setdefault(chat_id, {})
+        self.user_data = application.user_data.setdefault(user_id, {})
+
+
+class LoadTestApplication:
+    """
+    Локальная замена telegram.ext.Application: очередь обновлений и обработчики,
+    которые разбирают ее с заданной параллельностью (аналог concurrent_updates).
+    """
+    def __init__(self, handler, concurrent_updates = 1):
+        '''
+        Args:
+            handler: Асинхронный обработчик сообщений (например, telegram_bot.handle_message).
+            concurrent_updates (int): Сколько обновлений обрабатывается одновременно.
+                                      По умолчанию Application обрабатывает их по одному.
+        '''
+        self.handler = handler
+        self.concurrent_updates = concurrent_updates
+        self.bot_data = {}
+        self.chat_data = {}
+        self.user_data = {}
+        self.update_queue = None
+        self._workers = []
+
+    async def start(self):
+        '''Создает очередь обновлений и запускает обработчики.'''
+        self.update_queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrent_updates)]
+
+    async def stop(self):
+        '''Дожидается обработки очереди и останавливает обработчики.'''
+        await self.update_queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions = True)
+
+    async def process_update(self, update):
+        '''
+        Ставит обновление в очередь и ждет окончания его обработки.
+
+        Returns:
+            dict: Замеры времени для обновления.
+        '''
+        done = asyncio.get_running_loop().create_future()
+        await self.update_queue.put((update, time.perf_counter(), done))
+        return await done
+
+    async def _worker(self):
+        '''Берет обновления из очереди и передает их обработчику.'''
+        while True:
+            update, enqueued_at, done = await self.update_queue.get()
+            started_at = time.perf_counter()
+            context = FakeContext(self, update.effective_chat.id, update.effective_user.id)
+            result = {'enqueued_at': enqueued_at, 'started_at': started_at, 'exception': None}
+
+            try:
+                await self.handler(update, context)
+            except Exception as e:
+                logging.error(f'Необработанное исключение в обработчике: {e}')
+                result['exception'] = repr(e)
+            finally:
+                result['finished_at'] = time.perf_counter()
+                self.update_queue.task_done()
+                done.set_result(result)
+
+
+class BackendTimer:
+    """Обертка вокруг функции RAG-системы, замеряющая время каждого вызова в потоке исполнителя."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.durations = []
+        self._lock = threading.Lock()
+
+    def __call__(self, query, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.backend(query, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.durations.append(time.perf_counter() - start)
+
+
+def make_stub_backend(latency, jitter, error_rate):
+    '''
+    Создает локальную замену run_rag_query без моделей и базы данных.
+
+    Args:
+        latency (float): Среднее время ответа в секундах.
+        jitter (float): Относительный разброс времени ответа (0.2 = ±20%).
+        error_rate (float): Доля запросов, завершающихся исключением.
+
+    Returns:
+        callable: Функция с сигнатурой run_rag_query.
+    '''
+    def stub_rag_query(query, *args, **kwargs):
+        time.sleep(max(0.0, latency * random.uniform(1 - jitter, 1 + jitter)))
+        if random.random() < error_rate:
+            raise RuntimeError('Искусственная ошибка нагрузочного теста')
+        return f'Тестовый ответ на вопрос: {query}'
+
+    return stub_rag_query
+
+
+def load_question_mix(path):
+    '''
+    Загружает набор вопросов из файла: по одному на строку, вес можно указать
+    перед вопросом через табуляцию ("3<TAB>Что такое кортеж?").
+
+    Returns:
+        list: Список пар (вопрос, вес).
+    '''
+    mix = []
+
+    with open(path, 'r', encoding = 'utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            weight, separator, question = line.partition('\t')
+            if separator and weight.replace('.', '', 1).isdigit():
+                mix.append((question.strip(), float(weight)))
+            else:
+                mix.append((line, 1.0))
+
+    return mix
+
+
+async def simulate_user(application, user_id, question_mix, requests_per_user, think_time, deadline, records):
+    '''
+    Имитирует одного пользователя: отправляет вопросы, ждет ответа и "думает" между запросами.
+
+    Args:
+        application (LoadTestApplication): Приложение, обрабатывающее обновления.
+        user_id (int): ID пользователя (он же ID чата).
+        question_mix (list): Пары (вопрос, вес).
+        requests_per_user (int): Сколько вопросов отправит пользователь.
+        think_time (float): Среднее время между ответом и следующим вопросом (экспоненциальное распределение).
+        deadline (float): Момент perf_counter, после которого новые вопросы не отправляются (None - без ограничения).
+        records (list): Список, в который добавляются замеры по каждому запросу.
+    '''
+    questions = [question for question, _ in question_mix]
+    weights = [weight for _, weight in question_mix]
+    user = FakeUser(user_id)
+    chat = FakeChat(user_id)
+
+    for i in range(requests_per_user):
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+        question = random.choices(questions, weights)[0]
+        message = FakeMessage(question, chat, user)
+        sent_at = time.perf_counter()
+
+        result = await application.process_update(FakeUpdate(message))
+
+        reply_at, reply = message.replies[-1] if message.replies else (result['finished_at'], None)
+        records.append({
+            'user_id': user_id,
+            'question': question,
+            'sent_at': sent_at,
+            'queue_time': result['started_at'] - result['enqueued_at'],
+            'handler_time': result['finished_at'] - result['started_at'],
+            'latency': reply_at - sent_at,
+            'error': result['exception'] is not None or reply is None or reply in ERROR_REPLIES,
+        })
+
+        if think_time > 0 and i + 1 < requests_per_user:
+            await asyncio.sleep(random.expovariate(1 / think_time))
+
+
+def percentile(values, p):
+    '''
+    Вычисляет перцентиль с линейной интерполяцией.
+
+    Args:
+        values (list): Значения.
+        p (float): Перцентиль от 0 до 100.
+
+    Returns:
+        float: Значение перцентиля (0.0 для пустого списка).
+    '''
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    '''Возвращает среднее, перцентили и максимум для списка времен.'''
+    return {
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else 0.0,
+    }
+
+
+async def run_load_test(handler, users, arrival_rate, requests_per_user, think_time, question_mix,
+                        concurrent_updates = 1, duration = None):
+    '''
+    Запускает нагрузочный тест обработчика сообщений.
+
+    Args:
+        handler: Асинхронный обработчик сообщений.
+        users (int): Количество синтетических пользователей.
+        arrival_rate (float): Интенсивность появления новых пользователей в секунду (0 - все сразу).
+        requests_per_user (int): Количество вопросов от каждого пользователя.
+        think_time (float): Среднее время "обдумывания" между вопросами, с.
+        question_mix (list): Пары (вопрос, вес).
+        concurrent_updates (int): Параллельность обработки обновлений.
+        duration (float): Максимальная длительность отправки вопросов, с (None - без ограничения).
+
+    Returns:
+        dict: Отчет с пропускной способностью, задержками и долей ошибок.
+    '''
+    application = LoadTestApplication(handler, concurrent_updates)
+    await application.start()
+
+    records = []
+    started_at = time.perf_counter()
+    deadline = started_at + duration if duration else None
+    tasks = []
+
+    for user_id in range(1, users + 1):
+        tasks.append(asyncio.create_task(
+            simulate_user(application, user_id, question_mix, requests_per_user, think_time, deadline, records)
+        ))
+
+        # Пользователи приходят как пуассоновский поток
+        if arrival_rate > 0 and user_id < users:
+            await asyncio.sleep(random.expovariate(arrival_rate))
+
+    await asyncio.gather(*tasks)
+    await application.stop()
+    elapsed = time.perf_counter() - started_at
+
+    errors = sum(1 for record in records if record['error'])
+    return {
+        'users': users,
+        'concurrent_updates': concurrent_updates,
+        'requests': len(records),
+        'errors': errors,
+        'error_rate': errors / len(records) if records else 0.0,
+        'elapsed': elapsed,
+        'throughput': len(records) / elapsed if elapsed > 0 else 0.0,
+        'latency': summarize([record['latency'] for record in records]),
+        'queue_time': summarize([record['queue_time'] for record in records]),
+        'handler_time': summarize([record['handler_time'] for record in records]),
+    }
+
+
+def print_report(report):
+    '''Выводит отчет нагрузочного теста.'''
+    print(f"Пользователей: {report['users']}, параллельность обработки: {report['concurrent_updates']}")
+    print(f"Запросов: {report['requests']}, ошибок: {report['errors']} ({report['error_rate']:.1%})")
+    print(f"Длительность: {report['elapsed']:.2f} с, пропускная способность: {report['throughput']:.2f} запр/с")
+    print(f"{'метрика, с':<16}{'среднее':>10}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'макс':>10}")
+
+    for name in ('latency', 'queue_time', 'handler_time', 'backend_time'):
+        if name not in report:
+            continue
+        row = report[name]
+        print(
+            f"{name:<16}{row['mean']:>10.3f}{row['p50']:>10.3f}{row['p90']:>10.3f}"
+            f"{row['p95']:>10.3f}{row['p99']:>10.3f}{row['max']:>10.3f}"
+        )
+
+
+def main():
+    '''Запускает нагрузочный тест Telegram-бота без обращения к Telegram API.'''
+    parser = argparse.ArgumentParser(description = 'Нагрузочный тест обработчика сообщений Telegram-бота')
+    parser.add_argument('--users', type = int, default = 10, help = 'Количество синтетических пользователей')
+    parser.add_argument('--arrival-rate', type = float, default = 1.0,
+                        help = 'Новых пользователей в секунду (0 - все приходят сразу)')
+    parser.add_argument('--requests-per-user', type = int, default = 3, help = 'Вопросов от каждого пользователя')
+    parser.add_argument('--think-time', type = float, default = 2.0, help = 'Среднее время между вопросами, с')
+    parser.add_argument('--duration', type = float, default = None, help = 'Ограничение длительности теста, с')
+    parser.add_argument('--questions-file', default = None, help = 'Файл с вопросами ("вес<TAB>вопрос" или "вопрос")')
+    parser.add_argument('--concurrent-updates', type = int, default = 1,
+                        help = 'Сколько сообщений бот обрабатывает одновременно')
+    parser.add_argument('--executor-workers', type = int, default = None,
+                        help = 'Размер пула потоков для run_in_executor (по умолчанию как в asyncio)')
+    parser.add_argument('--backend', choices = ['stub', 'rag'], default = 'stub',
+                        help = 'stub - локальная замена RAG-системы, rag - настоящая run_rag_query')
+    parser.add_argument('--stub-latency', type = float, default = 0.5, help = 'Среднее время ответа заглушки, с')
+    parser.add_argument('--stub-jitter', type = float, default = 0.2, help = 'Относительный разброс времени заглушки')
+    parser.add_argument('--stub-error-rate', type = float, default = 0.0, help = 'Доля ошибок заглушки')
+    parser.add_argument('--seed', type = int, default = None, help = 'Seed генератора случайных чисел')
+    parser.add_argument('--json', action = 'store_true', help = 'Вывести отчет в формате JSON')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    question_mix = load_question_mix(args.questions_file) if args.questions_file else DEFAULT_QUESTION_MIX
+
+    # Подменяем функцию RAG-системы, которую вызывает handle_message, оберткой с замером времени
+    if args.backend == 'stub':
+        backend = make_stub_backend(args.stub_latency, args.stub_jitter, args.stub_error_rate)
+        telegram_bot.RAG_AVAILABLE = True
+    else:
+        if not telegram_bot.RAG_AVAILABLE:
+            print('RAG-система недоступна, используйте --backend stub')
+            return
+        backend = telegram_bot.run_rag_query
+
+    timer = BackendTimer(backend)
+    telegram_bot.run_rag_query = timer
+
+    async def run():
+        if args.executor_workers:
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(args.executor_workers))
+
+        return await run_load_test(
+            telegram_bot.handle_message,
+            users = args.users,
+            arrival_rate = args.arrival_rate,
+            requests_per_user = args.requests_per_user,
+            think_time = args.think_time,
+            question_mix = question_mix,
+            concurrent_updates = args.concurrent_updates,
+            duration = args.duration,
+        )
+
+    report = asyncio.run(run())
+    report['backend_time'] = summarize(timer.durations)
+    logging.info(f'Результаты нагрузочного теста: {report}')
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii = False, indent = 2))
+    else:
+        print_report(report)
+
+# Точка входа в программу
+if __name__ == "__main__":
+    main()
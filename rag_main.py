@@ -1,11 +1,15 @@
 import logging
 import os
+import threading
 
 # Импортируем основные компоненты RAG-системы
 from rag_setup import RAGOrchestrator
 from rag_retriever import Retriever
 from rag_generator import Generator
 from rag_setup import VectorDB
+from rag_chunk_store import ChunkStore
+from rag_resources import ResourceManager
+from rag_sessions import SessionManager
 
 # Настройка логирования для главного файла
 logging.basicConfig(
@@ -15,6 +19,16 @@ logging.basicConfig(
     encoding = 'utf-8'
 )
 
+# Распределение потоков CPU между поиском и генерацией для всех запросов процесса
+resource_manager = ResourceManager()
+
+# Сессии чатов: история диалога, найденные чанки и кэш промпта
+session_manager = SessionManager()
+
+# Компоненты для обработки запросов загружаются один раз и переиспользуются
+_rag_components = None
+_rag_components_lock = threading.Lock()
+
 def setup_rag_system():
     '''
     Выполняет первоначальную настройку RAG-системы.
@@ -34,12 +48,71 @@ def setup_rag_system():
         logging.error(f'Ошибка при настройке RAG системы: {str(e)}')
         raise
 
-def run_rag_query(query):
+def sync_chunk_store(vector_db = None):
+    '''
+    Создает хранилище чанков из уже существующей векторной базы.
+    Нужно, если база была проиндексирована до появления хранилища чанков.
+
+    Args:
+        vector_db (VectorDB): Инициализированная векторная база. Если None, создается новое подключение.
+    '''
+    logging.info('Хранилище чанков не найдено, импортируем чанки из ChromaDB')
+
+    if vector_db is None:
+        vector_db = VectorDB()
+        vector_db.initialize_client()
+
+    chunk_store = ChunkStore()
+    try:
+        chunk_store.import_from_collection(vector_db.collection)
+    finally:
+        chunk_store.close()
+
+def get_rag_components():
+    '''
+    Возвращает компоненты для обработки запросов, загружая их при первом вызове.
+    Модели загружаются один раз, а не на каждый запрос.
+
+    Returns:
+        tuple: (Retriever, Generator).
+    '''
+    global _rag_components
+
+    with _rag_components_lock:
+        if _rag_components is None:
+            logging.info('Загрузка компонентов RAG-системы')
+
+            # 1. Инициализируем векторную базу данных для поиска
+            vector_db = VectorDB()
+            vector_db.initialize_client()
+
+            # Тексты чанков читаем из хранилища.
+            # Если база проиндексирована без него, хранилище один раз заполняется из ChromaDB
+            chunk_store = ChunkStore()
+            if not chunk_store.exists():
+                sync_chunk_store(vector_db)
+            chunk_store.open()
+
+            # 2. Создаем и инициализируем компонент поиска (retriever)
+            retriever = Retriever(vector_db, chunk_store)
+            retriever.initialize_retriever()
+
+            # 3. Создаем и инициализируем генератор ответов
+            generator = Generator()
+            generator.initialize_generator()
+
+            _rag_components = (retriever, generator)
+
+    return _rag_components
+
+def run_rag_query(query, session_id = None):
     '''
     Обрабатывает один запрос пользователя.
 
     Args:
         query (str): Вопрос пользователя.
+        session_id: ID сессии (например, ID чата). Если передан, учитывается история диалога,
+                    а для уточняющих вопросов переиспользуются найденные ранее чанки.
 
     Returns:
         str: Сгенерированный ответ.
@@ -47,23 +120,19 @@ def run_rag_query(query):
     logging.info(f'=== ВЫПОЛНЕНИЕ ЗАПРОСА: {query} ===')
 
     try:
-        # 1. Инициализируем векторную базу данных для поиска
-        vector_db = VectorDB()
-        vector_db.initialize_client()
+        retriever, generator = get_rag_components()
 
-        # 2. Создаем и инициализируем компонент поиска (retriever)
-        retriever = Retriever(vector_db)
-        retriever.initialize_retriever()
+        if session_id is None:
+            # 1. Ищем релевантные фрагменты текста в базе данных
+            with resource_manager.stage('embedding'):
+                relevant_chunks = retriever.search_relevant_chunks(query)
 
-        # 3. Ищем релевантные фрагменты текста в базе данных
-        relevant_chunks = retriever.search_relevant_chunks(query)
-
-        # 4. Создаем и инициализируем генератор ответов
-        generator = Generator()
-        generator.initialize_generator()
-
-        # 5. Генерируем ответ на основе найденных фрагментов
-        answer = generator.generate_answer(query, relevant_chunks)
+            # 2. Генерируем ответ на основе найденных фрагментов
+            # Число одновременных генераций ограничено, остальные запросы ждут своей очереди
+            with resource_manager.stage('generation'):
+                answer = generator.generate_answer(query, relevant_chunks)
+        else:
+            answer = _run_session_query(query, session_manager.get_session(session_id), retriever, generator)
 
         logging.info('=== ЗАПРОС ВЫПОЛНЕН УСПЕШНО ===')
 
@@ -73,6 +142,53 @@ def run_rag_query(query):
         logging.error(f'Ошибка при выполнении запроса: {str(e)}')
         raise
 
+def _run_session_query(query, session, retriever, generator):
+    '''
+    Обрабатывает запрос в рамках сессии чата.
+
+    Args:
+        query (str): Вопрос пользователя.
+        session (Session): Сессия чата.
+        retriever (Retriever): Компонент поиска.
+        generator (Generator): Генератор ответов.
+
+    Returns:
+        str: Сгенерированный ответ.
+    '''
+    # Сообщения одного чата обрабатываются по очереди
+    with session.lock:
+        # 1. Уточняющий вопрос по той же теме использует уже найденные чанки, иначе выполняем поиск
+        with resource_manager.stage('embedding'):
+            query_embedding = retriever.embed_query(query)
+
+            if session.is_follow_up(query, query_embedding):
+                logging.info(f'Сессия {session.session_id}: уточняющий вопрос, поиск пропущен')
+                relevant_chunks = retriever.get_chunk_texts(session.chunk_ids)
+            else:
+                hits = retriever.search_batch([query], query_embeddings = query_embedding.reshape(1, -1))[0]
+                relevant_chunks = [hit['text'] for hit in hits]
+                session.set_topic([hit['id'] for hit in hits], query_embedding)
+
+        # 2. Генерируем ответ с историей диалога и кэшем промпта сессии
+        with resource_manager.stage('generation'):
+            answer = generator.generate_answer(query, relevant_chunks, session)
+
+        session.add_exchange(query, answer)
+
+    # KV-кэш хранится только у нескольких последних активных сессий.
+    # Вызывается после освобождения блокировки сессии, чтобы не ждать и не блокировать другие чаты
+    session_manager.trim_prompt_caches()
+    return answer
+
+def reset_session(session_id):
+    '''
+    Сбрасывает историю диалога и найденные чанки сессии.
+
+    Args:
+        session_id: ID сессии.
+    '''
+    session_manager.reset_session(session_id)
+
 def main():
     '''
     Главная функция программы.
@@ -99,7 +215,7 @@ def main():
 
             # Обрабатываем непустой запрос
             if query.strip():
-                answer = run_rag_query(query)
+                answer = run_rag_query(query, session_id = 'console')
                 print(f"\nОтвет: {answer}")
             else:
                 print("Пожалуйста, введите непустой запрос")
@@ -0,0 +1,264 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+# Настройка логирования для менеджера ресурсов
+logging.basicConfig(
+    filename = 'rag_debug.log',
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s',
+    encoding = 'utf-8',
+)
+
+# threadpoolctl нужен только для ограничения потоков BLAS вне torch
+try:
+    from threadpoolctl import threadpool_limits
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
+
+# Доли ядер по умолчанию: генерация намного тяжелее эмбеддинга короткого запроса
+DEFAULT_STAGE_SHARES = {
+    'embedding': 0.25,
+    'generation': 0.75,
+}
+
+
+def get_available_cpus():
+    '''
+    Возвращает количество ядер, доступных процессу (с учетом привязки к ядрам, если она есть).
+
+    Returns:
+        int: Количество доступных ядер.
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+class ResourceManager:
+    """
+    Распределяет потоки CPU между этапами обработки запроса (эмбеддинг и генерация),
+    ограничивает число одновременно выполняемых этапов и перераспределяет бюджеты по нагрузке.
+
+    Число потоков torch и BLAS - настройка всего процесса, а не рабочего потока, поэтому оно
+    устанавливается одно на процесс: бюджет генерации, деленный на число одновременных генераций.
+    Бюджеты этапов соблюдаются за счет ограничения параллельности (семафоров).
+    """
+    def __init__(self, total_threads = None, stage_shares = None, max_concurrent = None,
+                 adapt_interval = 30.0, min_threads = 1, enabled = True):
+        '''
+        Инициализирует менеджер ресурсов.
+
+        Args:
+            total_threads (int): Общее количество потоков для всех этапов (по умолчанию - все доступные ядра).
+            stage_shares (dict): Доля потоков каждого этапа, например {'embedding': 0.25, 'generation': 0.75}.
+            max_concurrent (dict): Максимум одновременных выполнений этапа, например {'generation': 2}.
+                                   Этапы без ограничения выполняются без очереди.
+                                   По умолчанию генерации получают по 4 потока, а число эмбеддингов
+                                   ограничено так, чтобы они помещались в свой бюджет.
+            adapt_interval (float): Как часто (в секундах) перераспределять потоки по наблюдаемой нагрузке.
+                                    0 или None - не перераспределять.
+            min_threads (int): Минимальный бюджет потоков этапа.
+            enabled (bool): Если False, потоки и параллельность не ограничиваются (собирается только статистика).
+        '''
+        self.total_threads = total_threads or get_available_cpus()
+        self.stage_shares = dict(stage_shares or DEFAULT_STAGE_SHARES)
+        self.adapt_interval = adapt_interval
+        self.min_threads = min_threads
+        self._enabled = enabled
+        # Число потоков torch до установки ограничения, None - ограничение не установлено
+        self._previous_torch_threads = None
+        # Действующее ограничение потоков BLAS (threadpoolctl), None - не установлено
+        self._blas_limiter = None
+
+        # Бюджет потоков этапа, делится между его одновременными выполнениями
+        self.budgets = self._budgets_from_shares(self.stage_shares)
+
+        if max_concurrent is None:
+            max_concurrent = {'generation': max(1, self.budgets['generation'] // 4)}
+            threads = max(self.min_threads, self.budgets['generation'] // max_concurrent['generation'])
+            max_concurrent['embedding'] = max(1, self.budgets['embedding'] // threads)
+        self.max_concurrent = dict(max_concurrent)
+        # Число потоков torch и BLAS для всего процесса
+        self.threads_per_run = self._get_threads_per_run()
+        self._semaphores = {
+            stage: threading.BoundedSemaphore(limit) for stage, limit in self.max_concurrent.items()
+        }
+
+        self._lock = threading.Lock()
+        self._active = {stage: 0 for stage in self.budgets}
+        self._waiting = {stage: 0 for stage in self.budgets}
+        self._completed = {stage: 0 for stage in self.budgets}
+        self._wait_time = {stage: 0.0 for stage in self.budgets}
+        self._run_time = {stage: 0.0 for stage in self.budgets}
+        # Время работы этапов за текущее окно адаптации
+        self._window_busy = {stage: 0.0 for stage in self.budgets}
+        self._window_start = time.monotonic()
+
+        logging.info(
+            f'Инициализация ResourceManager: потоков={self.total_threads}, бюджеты={self.budgets}, '
+            f'ограничения параллельности={self.max_concurrent}, потоков на выполнение={self.threads_per_run}'
+        )
+
+    @property
+    def enabled(self):
+        '''bool: Ограничиваются ли потоки и параллельность этапов.'''
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        with self._lock:
+            self._enabled = value
+            # Без менеджера процесс должен работать с исходными настройками torch и BLAS
+            if not value:
+                self._restore_thread_limits()
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Выполняет блок кода как этап с ограниченной параллельностью.
+        Ожидает свободного места, если для этапа задано ограничение параллельности.
+        При первом выполнении этапа для всего процесса устанавливается число потоков
+        torch и BLAS (threads_per_run); исходные значения возвращаются при enabled = False.
+
+        Args:
+            name (str): Название этапа ('embedding' или 'generation').
+
+        Yields:
+            int: Количество потоков, с которым выполняется этап.
+        '''
+        if name not in self.budgets:
+            raise ValueError(f'Неизвестный этап: {name}')
+
+        enabled = self.enabled
+        semaphore = self._semaphores.get(name) if enabled else None
+
+        with self._lock:
+            self._waiting[name] += 1
+            if enabled:
+                self._apply_thread_limits()
+
+        wait_start = time.perf_counter()
+        if semaphore is not None:
+            semaphore.acquire()
+        wait_time = time.perf_counter() - wait_start
+
+        with self._lock:
+            self._waiting[name] -= 1
+            self._active[name] += 1
+
+        run_start = time.perf_counter()
+        try:
+            yield torch.get_num_threads()
+        finally:
+            run_time = time.perf_counter() - run_start
+
+            with self._lock:
+                self._active[name] -= 1
+                self._completed[name] += 1
+                self._wait_time[name] += wait_time
+                self._run_time[name] += run_time
+                self._window_busy[name] += run_time
+                self._maybe_rebalance()
+
+            if semaphore is not None:
+                semaphore.release()
+
+    def get_stats(self):
+        '''
+        Возвращает статистику по этапам.
+
+        Returns:
+            dict: Для каждого этапа - бюджет потоков, активные и ожидающие выполнения,
+                  количество завершенных и среднее время ожидания и работы.
+        '''
+        with self._lock:
+            return {
+                stage: {
+                    'threads': self.budgets[stage],
+                    'max_concurrent': self.max_concurrent.get(stage),
+                    'active': self._active[stage],
+                    'waiting': self._waiting[stage],
+                    'completed': self._completed[stage],
+                    'mean_wait': self._wait_time[stage] / self._completed[stage] if self._completed[stage] else 0.0,
+                    'mean_run': self._run_time[stage] / self._completed[stage] if self._completed[stage] else 0.0,
+                }
+                for stage in self.budgets
+            }
+
+    def _get_threads_per_run(self):
+        '''Делит бюджет генерации между одновременными генерациями.'''
+        budget = self.budgets.get('generation', self.total_threads)
+        return max(self.min_threads, budget // (self.max_concurrent.get('generation') or 1))
+
+    def _budgets_from_shares(self, shares):
+        '''Переводит доли этапов в количество потоков, не опускаясь ниже min_threads.'''
+        total_share = sum(shares.values()) or 1.0
+        return {
+            stage: max(self.min_threads, int(round(self.total_threads * share / total_share)))
+            for stage, share in shares.items()
+        }
+
+    def _maybe_rebalance(self):
+        '''
+        Перераспределяет потоки между этапами пропорционально времени их работы
+        за последнее окно (вызывается под блокировкой).
+        '''
+        if not self.adapt_interval or not self.enabled:
+            return
+
+        now = time.monotonic()
+        if now - self._window_start < self.adapt_interval:
+            return
+
+        total_busy = sum(self._window_busy.values())
+        if total_busy > 0:
+            # Сглаживаем, чтобы один всплеск нагрузки не перекидывал все потоки на один этап
+            shares = {
+                stage: (self.stage_shares[stage] + self._window_busy[stage] / total_busy) / 2
+                for stage in self.budgets
+            }
+            self.stage_shares = shares
+            self.budgets = self._budgets_from_shares(shares)
+            logging.info(f'ResourceManager: новые бюджеты потоков {self.budgets}')
+
+            # Число потоков зависит от бюджета генерации, поэтому переустанавливаем его
+            self.threads_per_run = self._get_threads_per_run()
+            if self._previous_torch_threads is not None:
+                self._restore_thread_limits()
+                self._apply_thread_limits()
+
+        self._window_busy = {stage: 0.0 for stage in self.budgets}
+        self._window_start = now
+
+    def _apply_thread_limits(self):
+        '''
+        Устанавливает число потоков torch и BLAS вне torch для всего процесса,
+        чтобы одновременные этапы не занимали все ядра каждый (вызывается под блокировкой).
+        '''
+        if self._previous_torch_threads is not None:
+            return
+
+        self._previous_torch_threads = torch.get_num_threads()
+        torch.set_num_threads(self.threads_per_run)
+
+        if THREADPOOLCTL_AVAILABLE:
+            self._blas_limiter = threadpool_limits(limits = self.threads_per_run, user_api = 'blas')
+
+        logging.info(f'ResourceManager: установлено {self.threads_per_run} потоков на выполнение')
+
+    def _restore_thread_limits(self):
+        '''Возвращает исходное число потоков torch и BLAS (вызывается под блокировкой).'''
+        if self._previous_torch_threads is not None:
+            torch.set_num_threads(self._previous_torch_threads)
+            self._previous_torch_threads = None
+
+        if self._blas_limiter is not None:
+            self._blas_limiter.restore_original_limits()
+            self._blas_limiter = None
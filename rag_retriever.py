@@ -1,4 +1,5 @@
 import logging
+import re
 from rag_setup import EmbeddingManager
 
 # Настройка логирования для модуля поиска
@@ -9,17 +10,201 @@ logging.basicConfig(
     encoding = 'utf-8',
 )
 
+# Константа сглаживания для Reciprocal Rank Fusion (значение из оригинальной статьи)
+RRF_K = 60
+
+# Словарь для перевода терминов вопроса на английский (документация на английском).
+# Ключ - основа русского слова, значение - английские ключевые слова.
+# Короткие основы перечислены формами слова, чтобы не совпадать с посторонними словами
+# ("цел" - "цель", "числ" - "в том числе", "данн" - "данный").
+QUERY_GLOSSARY = {
+    'кортеж': 'tuple',
+    'список': 'list',
+    'списк': 'list',
+    'словар': 'dictionary dict',
+    'множеств': 'set',
+    'строк': 'string str',
+    'число': 'number',
+    'числа': 'number',
+    'чисел': 'number',
+    'числов': 'number numeric',
+    'целочисл': 'integer int',
+    'целое': 'integer int',
+    'целого': 'integer int',
+    'целые': 'integer int',
+    'целых': 'integer int',
+    'целым': 'integer int',
+    'плавающ': 'floating point float',
+    'логическ': 'boolean bool',
+    'типы': 'type',
+    'типа': 'type',
+    'типов': 'type',
+    'типом': 'type',
+    'типе': 'type',
+    'типам': 'type',
+    'типизац': 'type hints typing',
+    'переменн': 'variable',
+    'функци': 'function',
+    'лямбд': 'lambda',
+    'аргумент': 'argument',
+    'параметр': 'parameter',
+    'класс': 'class',
+    'объект': 'object',
+    'метод': 'method',
+    'атрибут': 'attribute',
+    'наследован': 'inheritance',
+    'модул': 'module',
+    'пакет': 'package',
+    'импорт': 'import',
+    'исключени': 'exception',
+    'ошибк': 'error exception',
+    'цикл': 'loop for while',
+    'услови': 'condition if',
+    'итератор': 'iterator',
+    'генератор': 'generator yield',
+    'декоратор': 'decorator',
+    'контекстн': 'context manager with',
+    'област': 'scope',
+    'видимост': 'scope namespace',
+    'пространств': 'namespace',
+    'оператор': 'statement operator',
+    'выражени': 'expression',
+    'срез': 'slice',
+    'индекс': 'index',
+    'сравнени': 'comparison',
+    'файл': 'file',
+    'чтени': 'read',
+    'запись': 'write',
+    'записи': 'write',
+    'записа': 'write',
+    'записыва': 'write',
+    'форматирован': 'formatting format',
+    'ввод': 'input',
+    'вывод': 'output print',
+    'виртуальн': 'virtual',
+    'окружени': 'environment venv',
+    'библиотек': 'library',
+    'стандартн': 'standard',
+    'интерпретатор': 'interpreter',
+    'командн': 'command line',
+    'синтаксис': 'syntax',
+    'лексическ': 'lexical',
+    'модел': 'model',
+    'данные': 'data',
+    'данных': 'data',
+    'данными': 'data',
+    'данным': 'data',
+    'структур': 'structures',
+}
+
+# Слова, которые переводятся только целиком (как основы они совпали бы с посторонними словами:
+# "тип" - с "типичный")
+QUERY_GLOSSARY_WORDS = {
+    'тип': 'type',
+}
+
+# Слова, которые не несут смысла для поиска
+QUERY_STOP_WORDS = {
+    'что', 'как', 'какой', 'какая', 'какое', 'какие', 'такое', 'это', 'есть', 'ли', 'в', 'во', 'на', 'и', 'или',
+    'для', 'чем', 'чего', 'зачем', 'почему', 'где', 'когда', 'можно', 'нужно', 'мне', 'про', 'о', 'об', 'с', 'по',
+    'от', 'до', 'из', 'не', 'а', 'но', 'работает', 'расскажи', 'объясни', 'python', 'питон', 'питоне', 'пайтон',
+}
+
+
+def expand_query(query, translate = None):
+    '''
+    Формирует несколько вариантов запроса для поиска по английской документации:
+    исходный вопрос, его перевод на английский и английские ключевые слова.
+
+    Args:
+        query (str): Вопрос пользователя на русском языке.
+        translate (callable): Необязательная функция перевода str -> str.
+                              Если не задана, перевод не добавляется.
+
+    Returns:
+        list: Список уникальных вариантов запроса, первый - исходный вопрос.
+    '''
+    expansions = [query]
+
+    if translate is not None:
+        try:
+            translation = translate(query)
+            if translation:
+                expansions.append(translation.strip())
+        except Exception as e:
+            logging.warning(f'Не удалось перевести запрос: {str(e)}')
+
+    keywords = []
+    for word in re.findall(r'[\w.]+', query.lower()):
+        # Точка в конце предложения не относится к идентификатору (os.path.join.)
+        word = word.strip('.')
+        if not word or word in QUERY_STOP_WORDS:
+            continue
+
+        if word in QUERY_GLOSSARY_WORDS:
+            keywords.extend(QUERY_GLOSSARY_WORDS[word].split())
+            continue
+
+        # Английские слова и идентификаторы (with, __init__, os.path) оставляем как есть
+        if re.fullmatch(r'[a-z_][\w.]*', word):
+            keywords.append(word)
+            continue
+
+        for stem, english in QUERY_GLOSSARY.items():
+            if word.startswith(stem):
+                keywords.extend(english.split())
+                break
+
+    if keywords:
+        # Убираем повторы, сохраняя порядок
+        expansions.append(' '.join(dict.fromkeys(keywords)))
+
+    return list(dict.fromkeys(expansion for expansion in expansions if expansion))
+
+
+def fuse_results(results_per_query, n_results = None):
+    '''
+    Объединяет результаты нескольких запросов методом Reciprocal Rank Fusion.
+    Чанки, найденные несколькими запросами, объединяются в один результат.
+
+    Args:
+        results_per_query (list): Для каждого запроса - список найденных чанков (словари с 'id', 'distance', ...).
+        n_results (int): Сколько лучших чанков вернуть (None - все).
+
+    Returns:
+        list: Словари чанков с полями 'score' (сумма 1 / (RRF_K + ранг)), 'distance' (минимальное
+              расстояние) и 'query_indices' (номера запросов, нашедших чанк), по убыванию score.
+    '''
+    fused = {}
+
+    for query_index, hits in enumerate(results_per_query):
+        for rank, hit in enumerate(hits):
+            if hit['id'] not in fused:
+                fused[hit['id']] = {**hit, 'score': 0.0, 'query_indices': []}
+
+            result = fused[hit['id']]
+            result['score'] += 1 / (RRF_K + rank + 1)
+            result['distance'] = min(result['distance'], hit['distance'])
+            result['query_indices'].append(query_index)
+
+    ranked = sorted(fused.values(), key = lambda result: (-result['score'], result['distance']))
+    return ranked[:n_results] if n_results is not None else ranked
+
+
 class Retriever:
     """Класс для поиска релевантных тектовых фрагментов (чанков) в векторной базе данных."""
-    def __init__(self, vector_db = None):
+    def __init__(self, vector_db = None, chunk_store = None):
         '''
         Инициализирует компонент поиска (retriever).
 
         Args:
             vector_db: Экземпляр VectorDB для выполнения поиска.
                        Если None, нужно будет передать его позже.
+            chunk_store: Открытый экземпляр ChunkStore. Если передан, тексты чанков
+                         берутся из него, а ChromaDB возвращает только ID.
         '''
         self.vector_db = vector_db
+        self.chunk_store = chunk_store
         # Используем тот же EmbeddingManager, что и для индексации, чтобы создавать эмбеддинги запросов в том же пространстве
         self.embedding_manager = EmbeddingManager()
         logging.info('Инициализирован retriever')
@@ -33,6 +218,19 @@ class Retriever:
         self.embedding_manager.initialize_model()
         logging.info('Retriever модель инициализирована успешно')
 
+    def embed_query(self, query):
+        '''
+        Создает эмбеддинг текстового запроса.
+
+        Args:
+            query (str): Текстовый запрос.
+
+        Returns:
+            numpy.ndarray: Эмбеддинг запроса.
+        '''
+        self._check_initialized()
+        return self.embedding_manager.create_embeddings_for_chunks([query])[0]
+
     def search_relevant_chunks(self, query, n_results = 3):
         '''
         Ищет в векторной базе данных чанки, наиболее релевантные текстовому запросу.
@@ -48,13 +246,8 @@ class Retriever:
             ValueError: Если векторная база или модель не инициализированы.
             Exception: При ошибке поиска.
         '''
-        # Проверка, что векторная база данных инициализирована
-        if self.vector_db is None or self.vector_db.collection is None:
-            raise ValueError('Векторная база не инициализирована')
-
-        # Проверка, что модель для создания эмбеддингов инициализирована
-        if self.embedding_manager.model is None:
-            raise ValueError('Модель retriever не инициализирована')
+        self._check_initialized()
+        self._refresh_chunk_store()
 
         logging.info(f'Поиск релевантных чанков для запроса: {query}')
 
@@ -67,15 +260,21 @@ class Retriever:
             # query_embeddings должен быть списком списков (или numpy массивом)
             # query_embedding[0] - это первый (и единственный) эмбеддинг из списка
             # .tolist() преобразует numpy массив в обычный Python список
+            # Если есть хранилище чанков, тексты из ChromaDB не запрашиваем (ID возвращаются всегда)
+            include = ['distances'] if self.chunk_store is not None else ['documents', 'distances']
             results = self.vector_db.collection.query(
                 query_embeddings = [query_embedding[0].tolist()],
-                n_results = n_results
+                n_results = n_results,
+                include = include
             )
 
             # 3. Извлекаем тексты найденных релевантных чанков из результатов
             # ChromaDB возвращает вложенные списки, поэтому берем [0]
             # чтобы получить плоский список текстов чанков
-            relevant_chunks = results['documents'][0]
+            if self.chunk_store is not None:
+                relevant_chunks = self.get_chunk_texts(results['ids'][0])
+            else:
+                relevant_chunks = results['documents'][0]
             logging.info(f'Найдено {len(relevant_chunks)} релевантных чанков')
             return relevant_chunks
 
@@ -83,4 +282,155 @@ class Retriever:
             logging.error(f'Ошибка при поиске релевантных чанков: {str(e)}')
             raise
 
+    def search_batch(self, queries, n_results = 3, query_embeddings = None):
+        '''
+        Ищет релевантные чанки сразу для нескольких запросов:
+        все запросы кодируются одним вызовом encode и отправляются в ChromaDB одним запросом.
+
+        Args:
+            queries (list): Список текстовых запросов.
+            n_results (int): Количество чанков для каждого запроса.
+            query_embeddings (numpy.ndarray): Уже посчитанные эмбеддинги запросов (тогда encode не вызывается).
+
+        Returns:
+            list: Для каждого запроса - список словарей с ключами 'id', 'text', 'distance', 'metadata'
+                  в порядке релевантности.
+
+        Raises:
+            ValueError: Если векторная база или модель не инициализированы.
+            Exception: При ошибке поиска.
+        '''
+        self._check_initialized()
+        self._refresh_chunk_store()
+
+        if not queries:
+            return []
+
+        logging.info(f'Пакетный поиск релевантных чанков для {len(queries)} запросов')
+
+        try:
+            # 1. Эмбеддинги всех запросов за один вызов модели
+            if query_embeddings is None:
+                query_embeddings = self.embedding_manager.create_embeddings_for_chunks(list(queries))
+
+            # 2. Один запрос к ChromaDB со всеми эмбеддингами
+            include = ['metadatas', 'distances'] if self.chunk_store is not None else ['documents', 'metadatas', 'distances']
+            results = self.vector_db.collection.query(
+                query_embeddings = query_embeddings.tolist(),
+                n_results = n_results,
+                include = include
+            )
+
+            # 3. Тексты всех найденных чанков получаем один раз, даже если чанк нашли несколько запросов
+            if self.chunk_store is not None:
+                all_ids = list(dict.fromkeys(chunk_id for ids in results['ids'] for chunk_id in ids))
+                texts = self._get_chunk_text_map(all_ids)
+            else:
+                texts = {
+                    chunk_id: document
+                    for ids, documents in zip(results['ids'], results['documents'])
+                    for chunk_id, document in zip(ids, documents)
+                }
+
+            results_per_query = []
+            for ids, distances, metadatas in zip(results['ids'], results['distances'], results['metadatas']):
+                results_per_query.append([
+                    {'id': chunk_id, 'text': texts[chunk_id], 'distance': distance, 'metadata': metadata}
+                    for chunk_id, distance, metadata in zip(ids, distances, metadatas)
+                    if chunk_id in texts
+                ])
+
+            logging.info(f'Пакетный поиск завершен: {sum(len(hits) for hits in results_per_query)} результатов')
+            return results_per_query
+
+        except Exception as e:
+            logging.error(f'Ошибка при пакетном поиске релевантных чанков: {str(e)}')
+            raise
+
+    def search_multi_query(self, queries, n_results = 3, n_per_query = None):
+        '''
+        Ищет чанки по нескольким запросам и объединяет результаты без повторов (Reciprocal Rank Fusion).
+
+        Args:
+            queries (list): Список текстовых запросов.
+            n_results (int): Количество чанков в итоговом результате.
+            n_per_query (int): Количество чанков для каждого запроса (по умолчанию равно n_results).
+
+        Returns:
+            list: Словари чанков с ключами 'id', 'text', 'distance', 'metadata', 'score', 'query_indices'.
+        '''
+        results_per_query = self.search_batch(queries, n_per_query or n_results)
+        return fuse_results(results_per_query, n_results)
+
+    def search_with_expansion(self, query, n_results = 3, n_per_query = None, translate = None):
+        '''
+        Расширяет вопрос пользователя (см. expand_query) и ищет чанки по всем вариантам сразу.
 
+        Args:
+            query (str): Вопрос пользователя.
+            n_results (int): Количество чанков в итоговом результате.
+            n_per_query (int): Количество чанков для каждого варианта запроса.
+            translate (callable): Необязательная функция перевода вопроса на английский.
+
+        Returns:
+            list: Словари чанков, как в search_multi_query.
+        '''
+        queries = expand_query(query, translate)
+        logging.info(f'Варианты запроса: {queries}')
+        return self.search_multi_query(queries, n_results, n_per_query)
+
+    def get_chunk_texts(self, ids):
+        '''
+        Возвращает тексты чанков по их ID.
+        Тексты берутся из хранилища чанков, а отсутствующие в нем - из ChromaDB.
+
+        Args:
+            ids (list): Список ID чанков.
+
+        Returns:
+            list: Список текстов чанков в порядке переданных ID.
+        '''
+        self._refresh_chunk_store()
+        texts = self._get_chunk_text_map(ids)
+        return [texts[chunk_id] for chunk_id in ids if chunk_id in texts]
+
+    def _get_chunk_text_map(self, ids):
+        '''
+        Возвращает словарь ID -> текст для переданных ID чанков.
+        Тексты берутся из хранилища чанков, а отсутствующие в нем - из ChromaDB.
+        '''
+        texts = {}
+
+        if self.chunk_store is not None:
+            for chunk_id in ids:
+                if chunk_id in self.chunk_store:
+                    texts[chunk_id] = self.chunk_store.get_chunk(chunk_id)
+
+        # Хранилище могло отстать от базы (например, после ручного добавления чанков)
+        missing = [chunk_id for chunk_id in ids if chunk_id not in texts]
+        if missing:
+            logging.warning(f'Чанки отсутствуют в ChunkStore, читаем из ChromaDB: {len(missing)}')
+            fallback = self.vector_db.collection.get(ids = missing, include = ['documents'])
+            texts.update(zip(fallback['ids'], fallback['documents']))
+
+        return texts
+
+    def _refresh_chunk_store(self):
+        '''Переходит на новое поколение хранилища чанков, если оно было опубликовано после переиндексации.'''
+        if self.chunk_store is not None:
+            self.chunk_store.refresh()
+
+    def _check_initialized(self):
+        '''
+        Проверяет, что векторная база и модель эмбеддингов инициализированы.
+
+        Raises:
+            ValueError: Если векторная база или модель не инициализированы.
+        '''
+        # Проверка, что векторная база данных инициализирована
+        if self.vector_db is None or self.vector_db.collection is None:
+            raise ValueError('Векторная база не инициализирована')
+
+        # Проверка, что модель для создания эмбеддингов инициализирована
+        if self.embedding_manager.model is None:
+            raise ValueError('Модель retriever не инициализирована')
@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Настройка логирования для сессий
+logging.basicConfig(
+    filename = 'rag_debug.log',
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s',
+    encoding = 'utf-8',
+)
+
+# Короткие вопросы, начинающиеся с этих слов, считаются уточнением предыдущего вопроса,
+# если они хотя бы отчасти близки к теме. Слова, с которых часто начинается новый вопрос
+# («почему», «зачем», «пример»), сюда не входят
+FOLLOW_UP_PREFIXES = ('а ', 'и ', 'еще', 'ещё', 'подробнее', 'как это', 'что если')
+FOLLOW_UP_MAX_WORDS = 5
+
+
+class Session:
+    """Состояние диалога в одном чате: короткая история, найденные чанки и кэш промпта генератора."""
+    def __init__(self, session_id, history_size = 3, max_answer_chars = 300):
+        '''
+        Инициализирует сессию.
+
+        Args:
+            session_id: ID сессии (ID чата в Telegram).
+            history_size (int): Сколько последних пар вопрос-ответ хранить.
+            max_answer_chars (int): Ответы в истории обрезаются до этой длины, чтобы промпт не разрастался.
+        '''
+        self.session_id = session_id
+        self.max_answer_chars = max_answer_chars
+        self.history = deque(maxlen = history_size)
+        # ID чанков, найденных для текущей темы, и эмбеддинг вопроса, с которого тема началась
+        self.chunk_ids = []
+        self.topic_embedding = None
+        # Кэш префикса промпта (KV-кэш модели), заполняется генератором
+        self.prompt_cache = None
+        self.last_active = time.monotonic()
+        # Запросы одного чата обрабатываются по очереди, чтобы история не перемешивалась
+        self.lock = threading.Lock()
+
+    def add_exchange(self, question, answer):
+        '''
+        Добавляет пару вопрос-ответ в историю.
+
+        Args:
+            question (str): Вопрос пользователя.
+            answer (str): Ответ системы.
+        '''
+        self.history.append((question, answer[:self.max_answer_chars]))
+
+    def set_topic(self, chunk_ids, topic_embedding):
+        '''
+        Запоминает найденные чанки для новой темы разговора.
+
+        Args:
+            chunk_ids (list): ID найденных чанков.
+            topic_embedding: Эмбеддинг вопроса, по которому выполнялся поиск.
+        '''
+        self.chunk_ids = list(chunk_ids)
+        self.topic_embedding = np.asarray(topic_embedding, dtype = np.float32)
+
+    def is_follow_up(self, query, query_embedding, similarity_threshold = 0.6, follow_up_similarity_threshold = 0.3):
+        '''
+        Проверяет, относится ли вопрос к текущей теме разговора.
+
+        Args:
+            query (str): Вопрос пользователя.
+            query_embedding: Эмбеддинг вопроса.
+            similarity_threshold (float): Минимальное косинусное сходство с вопросом, начавшим тему.
+            follow_up_similarity_threshold (float): Пониженный порог сходства для коротких уточнений
+                                                    («А если список пустой?»).
+
+        Returns:
+            bool: True, если можно переиспользовать найденные ранее чанки.
+        '''
+        if not self.chunk_ids or self.topic_embedding is None:
+            return False
+
+        query_embedding = np.asarray(query_embedding, dtype = np.float32)
+        norm = np.linalg.norm(query_embedding) * np.linalg.norm(self.topic_embedding)
+        if norm == 0:
+            return False
+
+        similarity = float(np.dot(query_embedding, self.topic_embedding) / norm)
+        if similarity >= similarity_threshold:
+            return True
+
+        # Формулировка уточнения сама по себе не доказывает, что тема та же («И что такое asyncio?»),
+        # поэтому короткому уточнению достаточно пониженного порога, но не нулевого
+        normalized = ' '.join(query.lower().split())
+        is_short_follow_up = len(normalized.split()) <= FOLLOW_UP_MAX_WORDS and normalized.startswith(FOLLOW_UP_PREFIXES)
+        return is_short_follow_up and similarity >= follow_up_similarity_threshold
+
+
+class SessionManager:
+    """
+    Хранит сессии чатов с ограничением по памяти: сессии удаляются после простоя,
+    а при превышении лимита вытесняются давно неактивные (LRU).
+    """
+    def __init__(self, max_sessions = 1000, idle_timeout = 1800.0, max_prompt_caches = 4,
+                 history_size = 3, max_answer_chars = 300):
+        '''
+        Инициализирует менеджер сессий.
+
+        Args:
+            max_sessions (int): Максимальное количество хранимых сессий.
+            idle_timeout (float): Время простоя в секундах, после которого сессия удаляется.
+            max_prompt_caches (int): Сколько последних активных сессий хранят KV-кэш промпта
+                                     (кэш занимает сотни мегабайт, поэтому их число ограничено отдельно).
+            history_size (int): Размер истории в каждой сессии.
+            max_answer_chars (int): Максимальная длина ответа в истории.
+        '''
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_prompt_caches = max_prompt_caches
+        self.history_size = history_size
+        self.max_answer_chars = max_answer_chars
+        # Порядок элементов - от давно неактивных к недавним
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        logging.info(f'Инициализация SessionManager: максимум {max_sessions} сессий, простой {idle_timeout} с')
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get_session(self, session_id):
+        '''
+        Возвращает сессию чата, создавая ее при необходимости.
+
+        Args:
+            session_id: ID сессии (ID чата).
+
+        Returns:
+            Session: Сессия чата.
+        '''
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_expired(now)
+
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self.history_size, self.max_answer_chars)
+                self._sessions[session_id] = session
+                logging.info(f'Создана сессия {session_id}')
+
+                # Вытесняем самые давно неактивные сессии
+                while len(self._sessions) > self.max_sessions:
+                    evicted_id, _ = self._sessions.popitem(last = False)
+                    logging.info(f'Сессия {evicted_id} вытеснена (LRU)')
+            else:
+                self._sessions.move_to_end(session_id)
+
+            session.last_active = now
+            return session
+
+    def reset_session(self, session_id):
+        '''
+        Удаляет сессию чата (история и кэш забываются).
+
+        Args:
+            session_id: ID сессии.
+        '''
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None:
+                logging.info(f'Сессия {session_id} сброшена')
+
+    def trim_prompt_caches(self):
+        '''
+        Освобождает KV-кэш у всех сессий, кроме max_prompt_caches последних активных.
+        Кэш очищается под блокировкой сессии, иначе генерация в другом потоке сохранит его снова.
+        Сессии, занятые запросом, пропускаются: их кэш будет очищен после завершения запроса,
+        поэтому вызывать метод нужно без удержания блокировок сессий.
+        '''
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        for session in sessions[:max(0, len(sessions) - self.max_prompt_caches)]:
+            if session.prompt_cache is None or not session.lock.acquire(blocking = False):
+                continue
+
+            try:
+                session.prompt_cache = None
+            finally:
+                session.lock.release()
+
+    def _evict_expired(self, now):
+        '''Удаляет сессии, простаивающие дольше idle_timeout (вызывается под блокировкой).'''
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active < self.idle_timeout:
+                break
+
+            del self._sessions[session_id]
+            logging.info(f'Сессия {session_id} удалена после простоя')
@@ -3,6 +3,7 @@ import os
 import chromadb
 from PyPDF2 import PdfReader
 from sentence_transformers import SentenceTransformer
+from rag_chunk_store import ChunkStore
 
 # Настройка логирования для отслеживания работы системы
 logging.basicConfig(
@@ -215,6 +216,9 @@ class VectorDB:
             chunks (list): Список текстовых чанков.
             embeddings (numpy.ndarray): Массив эмбеддингов для чанков.
             filename (str): Имя исходного файла.
+
+        Returns:
+            list: Список ID сохраненных чанков.
         '''
         if self.collection is None:
             raise ValueError('Хранилище не инициализировано. Вызовите initialize()')
@@ -237,6 +241,7 @@ class VectorDB:
             ids = ids
         )
         logging.info(f'Успешно сохранено {len(chunks)} чанков')
+        return ids
 
 
 class RAGOrchestrator:
@@ -248,6 +253,7 @@ class RAGOrchestrator:
         self.text_chunker = TextChunker()
         self.embedding_manager = EmbeddingManager()
         self.vector_db = VectorDB()
+        self.chunk_store = ChunkStore()
 
         logging.info('Инициализация RAGOrchestrator')
 
@@ -255,9 +261,10 @@ class RAGOrchestrator:
         '''
         Выполняет полную настройку RAG-системы:
         1. Инициализирует модель для эмбеддингов
-        2. Инициализирует векторную базу данных
+        2. Инициализирует векторную базу данных и очищает хранилище чанков
         3. Загружает все документы из папки
         4. Обрабатывает каждый документ (чанкинг -> эмбеддинги -> сохранение)
+        5. Публикует новое поколение хранилища чанков
         '''
         logging.info('Начало полной настройки RAG системы')
 
@@ -268,16 +275,24 @@ class RAGOrchestrator:
             # 2. Инициализируем векторную базу данных
             self.vector_db.initialize_client()
 
+            # Хранилище чанков переписывается целиком, чтобы соответствовать новой индексации
+            self.chunk_store.reset()
+
             # 3. Загружаем все документы из папки
             documents = self.document_processor.load_all_documents()
 
             # 4. Обрабатываем каждый документ по отдельности
             for document in documents:
                 self._process_single_document(document)
+
+            # Публикуем хранилище чанков целиком, когда проиндексированы все документы
+            self.chunk_store.commit()
             logging.info('Полная настройка RAG системы завершена успешно')
         except Exception as e:
             logging.error(f'Ошибка при настройке RAG системы: {str(e)}')
             raise
+        finally:
+            self.chunk_store.close()
 
     def _process_single_document(self, document):
         '''
@@ -297,7 +312,10 @@ class RAGOrchestrator:
             embeddings = self.embedding_manager.create_embeddings_for_chunks(chunks)
 
             # 3. Сохраняем чанки и эмбеддинги в векторную базу
-            self.vector_db.save_chunks(chunks, embeddings, source)
+            ids = self.vector_db.save_chunks(chunks, embeddings, source)
+
+            # 4. Дописываем тексты чанков в хранилище под теми же ID
+            self.chunk_store.append_chunks(ids, chunks)
 
             logging.info(f'Документ {source} обработан успешно')
 
@@ -19,12 +19,17 @@ logging.basicConfig(
 
 # Попытка импорта функции из RAG-системы
 try:
-    from rag_main import run_rag_query
+    from rag_main import reset_session, run_rag_query
     RAG_AVAILABLE = True
 except ImportError as e:
     logging.error(f"Не удалось импортировать RAG-систему: {e}")
     RAG_AVAILABLE = False
 
+# Ответы бота на случай недоступности системы или ошибки обработки
+UNAVAILABLE_MESSAGE = 'Таки извините, RAG-система таки временно недоступна.'
+NO_ANSWER_MESSAGE = 'Извините, не удалось сформулировать ответ на ваш вопрос.'
+ERROR_MESSAGE = 'Таки произошла ошибка при обработке вашего запроса. Таки попробуйте позже.'
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     '''
     Обрабатывает команду /start - отправляет приветственное сообщение с клавиатурой.
@@ -63,12 +68,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     # Проверка доступности RAG-системы
     if not RAG_AVAILABLE:
-        await update.message.reply_text('Таки извините, RAG-система таки временно недоступна.')
+        await update.message.reply_text(UNAVAILABLE_MESSAGE)
         return
 
-    # Получение текста сообщения от пользователя и установка имени пользователя для логирования
+    # Получение текста сообщения от пользователя, имени пользователя для логирования и ID чата для сессии
     user_message = update.message.text
-    user_name = 'Пользователь'
+    user_name = update.effective_user.first_name if update.effective_user else 'Пользователь'
+    chat_id = update.effective_chat.id
 
     logging.info(f"Новый запрос от {user_name}: {user_message}")
 
@@ -78,11 +84,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Обработка запроса
     try:
         # Вызываем функцию RAG-системы в отдельном потоке для избежания блокировки
-        answer = await asyncio.get_event_loop().run_in_executor(None, run_rag_query, user_message)
+        # Сессия привязана к чату: уточняющие вопросы учитывают предыдущие сообщения
+        answer = await asyncio.get_event_loop().run_in_executor(None, run_rag_query, user_message, chat_id)
 
         # Проверяем, что ответ получен и является строкой
         if not answer or not isinstance(answer, str):
-            answer = 'Извините, не удалось сформулировать ответ на ваш вопрос.'
+            answer = NO_ANSWER_MESSAGE
 
         logging.info(f'Ответ для {user_name} отправлен')
 
@@ -92,8 +99,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Если возникает любая ошибка при обработке запроса
     except Exception as e:
         logging.error(f'Ошибка при обработке запроса от {user_name}: {e}')
-        error_message = 'Таки произошла ошибка при обработке вашего запроса. Таки попробуйте позже.'
-        await update.message.reply_text(error_message)
+        await update.message.reply_text(ERROR_MESSAGE)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     '''
@@ -108,20 +114,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     help_text = (
         "/start - Начать работу с ботом\n"
         "/help - Показать справку\n"
-        "/stop - Остановить работу бота\n"
+        "/stop - Остановить работу бота и забыть историю диалога\n"
         "Просто отправьте текстовый вопрос, и я отвечу на основе документации Python!"
     )
     await update.message.reply_text(help_text)
 
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     '''
-    Обрабатывает команду /stop - отправляет сообщение о приостановке.
+    Обрабатывает команду /stop - сбрасывает сессию чата и отправляет сообщение о приостановке.
 
     Args:
         update (Update): Объект с информацией об обновлении от Telegram.
         context (ContextTypes.DEFAULT_TYPE): Контекст выполнения обработчика.
 
     '''
+    # Забываем историю диалога в этом чате
+    if RAG_AVAILABLE:
+        reset_session(update.effective_chat.id)
+
     # Создаем сообщение о приостановке
     stop_message = (
         "Бот приостановлен. Используйте /start для возобновления работы."